@@ -0,0 +1,153 @@
+# backend/admission.py
+import asyncio
+import logging
+import os
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+from fastapi import HTTPException
+from celery_app import celery_app, LIGHT_QUEUE, HEAVY_QUEUE
+from fair_share import RUNS_INFLIGHT_KEY
+from metrics import observe
+from redis_client import get_async_redis
+
+# New runs are turned away while either limit is reached; 0 disables a limit
+ADMISSION_MAX_QUEUED_TASKS = int(os.getenv('ADMISSION_MAX_QUEUED_TASKS', '5000'))
+ADMISSION_MAX_INFLIGHT_RUNS = int(os.getenv('ADMISSION_MAX_INFLIGHT_RUNS', '1000'))
+# Seconds a rejected client is asked to wait before retrying
+ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', '5'))
+# Requests that may wait in each API process for capacity instead of being rejected
+# right away, and for how long; 0 rejects as soon as a limit is reached
+ADMISSION_BUFFER_SIZE = int(os.getenv('ADMISSION_BUFFER_SIZE', '0'))
+ADMISSION_BUFFER_TIMEOUT = float(os.getenv('ADMISSION_BUFFER_TIMEOUT', '10'))
+ADMISSION_POLL_INTERVAL = float(os.getenv('ADMISSION_POLL_INTERVAL', '0.25'))
+# An admitted request holds a slot among the runs in flight until it has dispatched its
+# run, or at most this many seconds
+ADMISSION_RESERVATION_LEASE = int(os.getenv('ADMISSION_RESERVATION_LEASE', '30'))
+
+logger = logging.getLogger(__name__)
+
+# Sums the queue lengths and counts the live runs in flight in a single command. Given
+# a reservation id, it also takes a slot among the runs in flight when both are below
+# their limits (0 disables a limit), so concurrent requests can't be admitted on the
+# same free slot.
+_LOAD_SCRIPT = """
+local queued = 0
+for i = 2, #KEYS do
+    queued = queued + redis.call('LLEN', KEYS[i])
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+local inflight = redis.call('ZCARD', KEYS[1])
+local reserved = 0
+if ARGV[2] ~= '' then
+    local max_queued = tonumber(ARGV[4])
+    local max_inflight = tonumber(ARGV[5])
+    if (max_queued == 0 or queued < max_queued) and (max_inflight == 0 or inflight < max_inflight) then
+        redis.call('ZADD', KEYS[1], ARGV[3], ARGV[2])
+        reserved = 1
+    end
+end
+return {queued, inflight, reserved}
+"""
+
+_load_script = None
+_buffered = 0
+# Created on first use so it belongs to the server's event loop
+_buffer_lock = None
+
+def queue_keys() -> List[str]:
+    """
+    Returns the broker lists holding the tasks waiting in the workflow queues, one per
+    priority step (see broker_transport_options in celery_app).
+    """
+    options = celery_app.conf.broker_transport_options or {}
+    steps = options.get('priority_steps', [0])
+    sep = options.get('sep', ':')
+    return [f"{queue}{sep}{step}" if step else queue for queue in (LIGHT_QUEUE, HEAVY_QUEUE) for step in steps]
+
+async def _read_load(reservation: Optional[str] = None) -> Tuple[Dict[str, int], bool]:
+    global _load_script
+    if _load_script is None:
+        _load_script = get_async_redis().register_script(_LOAD_SCRIPT)
+    now = time.time()
+    queued, inflight, reserved = await _load_script(
+        keys=[RUNS_INFLIGHT_KEY] + queue_keys(),
+        args=[now, reservation or '', now + ADMISSION_RESERVATION_LEASE,
+              ADMISSION_MAX_QUEUED_TASKS, ADMISSION_MAX_INFLIGHT_RUNS]
+    )
+    return {'queued_tasks': queued, 'inflight_runs': inflight}, bool(reserved)
+
+async def get_load() -> Dict[str, int]:
+    """
+    Reads the tasks waiting in the broker and the runs in flight, in one round trip.
+    Runs whose lease ran out never finished and no longer count.
+    """
+    load, _ = await _read_load()
+    return load
+
+def _reject(load: Dict[str, int]):
+    logger.warning(f"Rejecting workflow run: {load['inflight_runs']} runs in flight, {load['queued_tasks']} tasks queued")
+    raise HTTPException(
+        status_code=429,
+        detail=f"Too much work in progress ({load['inflight_runs']} runs, {load['queued_tasks']} queued tasks), retry later",
+        headers={'Retry-After': str(ADMISSION_RETRY_AFTER)}
+    )
+
+async def _wait_for_capacity(reservation: str):
+    global _buffer_lock
+    if _buffer_lock is None:
+        _buffer_lock = asyncio.Lock()
+    # Buffered requests take turns, so they are admitted in arrival order
+    async with _buffer_lock:
+        while True:
+            await asyncio.sleep(ADMISSION_POLL_INTERVAL)
+            try:
+                _, reserved = await _read_load(reservation)
+            except Exception as e:
+                logger.warning(f"Admission control unavailable: {str(e)}")
+                return
+            if reserved:
+                return
+
+async def _admit(reservation: str):
+    global _buffered
+    try:
+        load, reserved = await _read_load(reservation)
+    except Exception as e:
+        logger.warning(f"Admission control unavailable: {str(e)}")
+        return
+    if reserved:
+        return
+    if _buffered >= ADMISSION_BUFFER_SIZE:
+        _reject(load)
+
+    _buffered += 1
+    started = time.monotonic()
+    try:
+        await asyncio.wait_for(_wait_for_capacity(reservation), ADMISSION_BUFFER_TIMEOUT)
+        observe('workflow_admission_wait_seconds', time.monotonic() - started)
+    except asyncio.TimeoutError:
+        _reject(load)
+    finally:
+        _buffered -= 1
+
+async def admit_run():
+    """
+    Dependency of the endpoints that start runs. Passes while the broker queues and
+    the runs in flight are below their limits; otherwise the request waits in the
+    process's submission buffer for up to ADMISSION_BUFFER_TIMEOUT seconds, or is
+    rejected with 429 and Retry-After when the buffer is full or the wait runs out.
+    Admission is not enforced while Redis can't be read.
+
+    An admitted request counts as a run in flight from the moment it is admitted
+    until it has been handled, by which time its run counts on its own.
+    """
+    reservation = f"admission:{uuid.uuid4().hex}"
+    try:
+        await _admit(reservation)
+        yield
+    finally:
+        try:
+            await get_async_redis().zrem(RUNS_INFLIGHT_KEY, reservation)
+        except Exception as e:
+            logger.warning(f"Could not release admission slot {reservation}: {str(e)}")
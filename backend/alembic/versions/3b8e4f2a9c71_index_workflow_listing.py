@@ -0,0 +1,34 @@
+"""Index workflow listing
+
+Revision ID: 3b8e4f2a9c71
+Revises: 6152da579de2
+Create Date: 2026-10-18 10:12:40.518233
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b8e4f2a9c71'
+down_revision: Union[str, None] = '6152da579de2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Keyset pagination walks (created_at, id) in descending order
+    op.create_index('ix_workflows_created_at_id', 'workflows', ['created_at', 'id'], unique=False)
+    # Trigram index so name searches (ILIKE '%term%') don't scan the table; PostgreSQL only
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.create_index('ix_workflows_name_trgm', 'workflows', ['name'], unique=False,
+                        postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_workflows_name_trgm', table_name='workflows')
+    op.drop_index('ix_workflows_created_at_id', table_name='workflows')
@@ -0,0 +1,26 @@
+"""Add node result fingerprint
+
+Revision ID: 5e2a9c47d1b3
+Revises: 9d1c7a5e2b40
+Create Date: 2026-10-18 16:05:42.118305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e2a9c47d1b3'
+down_revision: Union[str, None] = '9d1c7a5e2b40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('node_results', sa.Column('fingerprint', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('node_results', 'fingerprint')
@@ -0,0 +1,33 @@
+"""Backfill workflow created_at
+
+Revision ID: 7c3f1d8e2a64
+Revises: 5e2a9c47d1b3
+Create Date: 2026-10-18 18:20:11.604927
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c3f1d8e2a64'
+down_revision: Union[str, None] = '5e2a9c47d1b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Rows saved before created_at was set have no time; they are listed as the oldest,
+    # in id order, instead of ending the keyset pagination early
+    workflows = sa.table('workflows', sa.column('created_at', sa.DateTime()))
+    op.execute(workflows.update().where(workflows.c.created_at.is_(None)).values(created_at=datetime(1970, 1, 1)))
+    with op.batch_alter_table('workflows') as batch_op:
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('workflows') as batch_op:
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=True)
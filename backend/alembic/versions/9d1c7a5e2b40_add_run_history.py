@@ -0,0 +1,56 @@
+"""Add run history
+
+Revision ID: 9d1c7a5e2b40
+Revises: 3b8e4f2a9c71
+Create Date: 2026-10-18 13:41:07.226915
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d1c7a5e2b40'
+down_revision: Union[str, None] = '3b8e4f2a9c71'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('workflow_runs',
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('workflow_id', sa.Integer(), nullable=True),
+    sa.Column('status', sa.String(), nullable=True),
+    sa.Column('node_count', sa.Integer(), nullable=True),
+    sa.Column('failed_count', sa.Integer(), nullable=True),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['workflow_id'], ['workflows.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_workflow_runs_workflow_id_started_at', 'workflow_runs', ['workflow_id', 'started_at'], unique=False)
+    op.create_table('node_results',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('run_id', sa.String(), nullable=False),
+    sa.Column('node_id', sa.String(), nullable=True),
+    sa.Column('task_type', sa.String(), nullable=True),
+    sa.Column('status', sa.String(), nullable=True),
+    sa.Column('cache', sa.String(), nullable=True),
+    sa.Column('output', sa.JSON(), nullable=True),
+    sa.Column('error', sa.String(), nullable=True),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.Column('duration_ms', sa.Float(), nullable=True),
+    sa.ForeignKeyConstraint(['run_id'], ['workflow_runs.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_node_results_run_id'), 'node_results', ['run_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_node_results_run_id'), table_name='node_results')
+    op.drop_table('node_results')
+    op.drop_index('ix_workflow_runs_workflow_id_started_at', table_name='workflow_runs')
+    op.drop_table('workflow_runs')
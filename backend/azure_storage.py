@@ -1,40 +1,132 @@
 import os
-from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions
-from datetime import datetime, timedelta
+from azure.core.pipeline.transport import RequestsTransport
+from azure.storage.blob import BlobServiceClient, BlobBlock, generate_blob_sas, BlobSasPermissions
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Iterable, Optional, Tuple
+from requests import Session
+from requests.adapters import HTTPAdapter
+from metrics import span
+import base64
+import threading
+import time
 import uuid
 
 # Azure Blob Storage configurations
 AZURE_STORAGE_CONNECTION_STRING = os.getenv('AZURE_STORAGE_CONNECTION_STRING')
-CONTAINER_NAME = 'audiofiles'  
+CONTAINER_NAME = 'audiofiles'
+# Streamed audio is uploaded in blocks of this many bytes, several blocks at a time
+AUDIO_BLOCK_SIZE = int(os.getenv('AUDIO_BLOCK_SIZE', str(1024 * 1024)))
+AUDIO_UPLOAD_CONCURRENCY = int(os.getenv('AUDIO_UPLOAD_CONCURRENCY', '4'))
+# Keep-alive connections kept open to the storage account
+AZURE_CONNECTION_POOL_SIZE = int(os.getenv('AZURE_CONNECTION_POOL_SIZE', '20'))
 
-blob_service_client = BlobServiceClient.from_connection_string(AZURE_STORAGE_CONNECTION_STRING)
-container_client = blob_service_client.get_container_client(CONTAINER_NAME)
+# Signed URLs are reused until they are this close to expiring
+SAS_CACHE_SIZE = int(os.getenv('SAS_CACHE_SIZE', '1024'))
+SAS_REFRESH_MARGIN = int(os.getenv('SAS_REFRESH_MARGIN', '600'))
 
-def upload_audio_to_blob(audio_stream, filename=None):
+_blob_service_client = None
+_container_client = None
+_client_lock = threading.Lock()
+_sas_cache = OrderedDict()
+_sas_cache_lock = threading.Lock()
+
+def get_blob_service_client() -> BlobServiceClient:
+    """
+    Returns the process-wide storage client, creating it on first use so a missing
+    connection string only fails the tasks that store audio.
+    """
+    global _blob_service_client
+    if _blob_service_client is None:
+        with _client_lock:
+            if _blob_service_client is None:
+                session = Session()
+                adapter = HTTPAdapter(pool_connections=AZURE_CONNECTION_POOL_SIZE, pool_maxsize=AZURE_CONNECTION_POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _blob_service_client = BlobServiceClient.from_connection_string(
+                    AZURE_STORAGE_CONNECTION_STRING,
+                    transport=RequestsTransport(session=session, session_owner=False)
+                )
+    return _blob_service_client
+
+def get_container_client():
+    global _container_client
+    if _container_client is None:
+        _container_client = get_blob_service_client().get_container_client(CONTAINER_NAME)
+    return _container_client
+
+def stream_audio_to_blob(chunks: Iterable[bytes], filename: Optional[str] = None, container=None) -> str:
     """
-    Uploads an audio stream to Azure Blob Storage.
+    Uploads audio while it is still being produced: chunks are gathered into blocks of
+    AUDIO_BLOCK_SIZE bytes that are staged concurrently and committed once the stream
+    ends, so at most a few blocks are held in memory. `container` defaults to the
+    configured container client; any object with the same get_blob_client API works.
     Returns the filename used in the blob storage.
     """
     if not filename:
         filename = f"{uuid.uuid4()}.mp3"
+    blob_client = (container or get_container_client()).get_blob_client(filename)
+
+    block_ids = []
+    in_flight = []
 
-    blob_client = container_client.get_blob_client(filename)
-    blob_client.upload_blob(audio_stream, overwrite=True)
+    def stage(data: bytes):
+        block_id = base64.b64encode(f"{len(block_ids):08d}".encode()).decode()
+        block_ids.append(block_id)
+        in_flight.append(pool.submit(blob_client.stage_block, block_id, data))
+        # Wait for the oldest block once enough are uploading, bounding the memory held
+        if len(in_flight) >= AUDIO_UPLOAD_CONCURRENCY:
+            in_flight.pop(0).result()
 
+    with ThreadPoolExecutor(max_workers=AUDIO_UPLOAD_CONCURRENCY) as pool:
+        buffer = bytearray()
+        for chunk in chunks:
+            buffer += chunk
+            while len(buffer) >= AUDIO_BLOCK_SIZE:
+                stage(bytes(buffer[:AUDIO_BLOCK_SIZE]))
+                del buffer[:AUDIO_BLOCK_SIZE]
+        # What the upload adds on top of synthesis: the last blocks and the commit
+        with span('workflow_blob_upload_seconds'):
+            if buffer:
+                stage(bytes(buffer))
+            for future in in_flight:
+                future.result()
+            blob_client.commit_block_list([BlobBlock(block_id=block_id) for block_id in block_ids])
     return filename
 
-def generate_blob_sas_url(filename, expiry_hours=1):
+def generate_blob_sas_url(filename, expiry_hours=1) -> Tuple[str, float]:
     """
-    Generates a SAS URL for the uploaded audio file.
+    Generates a SAS URL for the uploaded audio file and returns it with the time it
+    expires (epoch seconds), which outputs that are stored and reused later must carry.
+    URLs are cached and handed out again until they are within SAS_REFRESH_MARGIN
+    seconds of expiring.
     """
+    now = time.time()
+    cache_key = (filename, expiry_hours)
+    with _sas_cache_lock:
+        cached = _sas_cache.get(cache_key)
+        if cached is not None and cached[1] - now > SAS_REFRESH_MARGIN:
+            _sas_cache.move_to_end(cache_key)
+            return cached
+
+    blob_service_client = get_blob_service_client()
+    expires_at = now + expiry_hours * 3600
     sas_token = generate_blob_sas(
         account_name=blob_service_client.account_name,
         container_name=CONTAINER_NAME,
         blob_name=filename,
         account_key=blob_service_client.credential.account_key,
         permission=BlobSasPermissions(read=True),
-        expiry=datetime.utcnow() + timedelta(hours=expiry_hours)
+        expiry=datetime.utcfromtimestamp(expires_at)
     )
 
     audio_url = f"https://{blob_service_client.account_name}.blob.core.windows.net/{CONTAINER_NAME}/{filename}?{sas_token}"
-    return audio_url
+
+    with _sas_cache_lock:
+        _sas_cache[cache_key] = (audio_url, expires_at)
+        _sas_cache.move_to_end(cache_key)
+        while len(_sas_cache) > SAS_CACHE_SIZE:
+            _sas_cache.popitem(last=False)
+    return audio_url, expires_at
@@ -0,0 +1,35 @@
+# backend/batch_status.py
+import os
+import uuid
+from typing import Any, Dict
+from redis_client import get_redis
+
+BATCH_ID_PREFIX = 'batch-'
+BATCH_KEY_PREFIX = 'workflow-batch:'
+BATCH_TTL = int(os.getenv('BATCH_STATUS_TTL', str(24 * 3600)))
+
+def new_batch_id() -> str:
+    return f"{BATCH_ID_PREFIX}{uuid.uuid4()}"
+
+def is_batch_id(task_id: str) -> bool:
+    return task_id.startswith(BATCH_ID_PREFIX)
+
+def batch_key(batch_id: str) -> str:
+    return f"{BATCH_KEY_PREFIX}{batch_id}"
+
+def get_batch_status(batch_id: str) -> Dict[str, Any]:
+    """
+    Returns the aggregate progress of a batch in the shape get_task_status uses.
+    """
+    raw = get_redis().hgetall(batch_key(batch_id))
+    if not raw:
+        return {'state': 'PENDING'}
+    status = {key.decode(): value.decode() for key, value in raw.items()}
+    return {
+        'state': status['state'],
+        'workflow_id': int(status['workflow_id']),
+        'total': int(status['total']),
+        'dispatched': int(status['dispatched']),
+        'completed': int(status['completed']),
+        'failed': int(status['failed'])
+    }
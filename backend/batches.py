@@ -0,0 +1,136 @@
+# backend/batches.py
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Any, AsyncIterator, Dict, List
+from fastapi.concurrency import run_in_threadpool
+from progress import TERMINAL_STATES
+from redis_client import get_async_redis
+from websocket_manager import manager
+from workflow_executor import WorkflowPlan, run_plan, get_task_status
+from batch_status import BATCH_TTL, batch_key
+from fair_share import release, try_acquire
+
+BATCH_DEFAULT_CONCURRENCY = int(os.getenv('BATCH_DEFAULT_CONCURRENCY', '10'))
+BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', '100'))
+# Seconds between status checks that back up the pushed completion event of an item
+BATCH_FALLBACK_INTERVAL = float(os.getenv('STATUS_FALLBACK_INTERVAL', '15'))
+# Seconds between attempts to get a fair share slot for the next item of a batch
+BATCH_SLOT_POLL_INTERVAL = float(os.getenv('BATCH_SLOT_POLL_INTERVAL', '0.5'))
+
+logger = logging.getLogger(__name__)
+
+def parse_parameter_set(line: bytes, index: int) -> Dict[str, Dict[str, Any]]:
+    """
+    Parses one NDJSON line, which maps node_ids to the data that replaces the block's
+    data for one run, e.g. {"text-1": {"prompt": "..."}}.
+    """
+    parameter_set = json.loads(line)
+    if not isinstance(parameter_set, dict) or not all(isinstance(v, dict) for v in parameter_set.values()):
+        raise ValueError(f"Parameter set {index} must map node ids to data objects")
+    return parameter_set
+
+async def _run_item(plan: WorkflowPlan, options: Dict[str, Any], batch_id: str, index: int,
+                    line: bytes, semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+    r = get_async_redis()
+    await r.hincrby(batch_key(batch_id), 'total', 1)
+    async with semaphore:
+        run_id = str(uuid.uuid4())
+        completion = manager.watch_run(run_id)
+        try:
+            overrides = parse_parameter_set(line, index)
+            unknown_nodes = set(overrides) - set(plan.blocks_by_id)
+            if unknown_nodes:
+                raise ValueError(f"Unknown node ids in parameter set: {sorted(unknown_nodes)}")
+            tenant = options.get('tenant')
+            if tenant:
+                # Hold the item back while its tenant is at its share of in-flight runs
+                while not await run_in_threadpool(try_acquire, tenant, run_id):
+                    await asyncio.sleep(BATCH_SLOT_POLL_INTERVAL)
+            try:
+                await run_in_threadpool(run_plan, plan, dict(options, slot_held=True), None, overrides, run_id)
+            except Exception:
+                await run_in_threadpool(release, tenant, run_id)
+                raise
+            await r.hincrby(batch_key(batch_id), 'dispatched', 1)
+
+            status = None
+            while status is None:
+                try:
+                    status = await asyncio.wait_for(asyncio.shield(completion), BATCH_FALLBACK_INTERVAL)
+                except asyncio.TimeoutError:
+                    # Safety net for a completion event that was missed
+                    polled = await run_in_threadpool(get_task_status, run_id)
+                    if polled['state'] in TERMINAL_STATES:
+                        status = polled
+        except Exception as e:
+            logger.error(f"Batch {batch_id} item {index} failed: {str(e)}")
+            status = {'state': 'FAILURE', 'error': str(e)}
+        finally:
+            manager.unwatch_run(run_id, completion)
+
+    node_failed = any('error' in output for output in status.get('result', {}).values())
+    failed = status['state'] != 'SUCCESS' or node_failed
+    await r.hincrby(batch_key(batch_id), 'failed' if failed else 'completed', 1)
+    return dict(status, index=index, task_id=run_id)
+
+async def start_batch(batch_id: str, workflow_id: int):
+    """
+    Records a new batch so its progress can be queried through get_task_status. Its
+    total grows as the items arrive.
+    """
+    pipe = get_async_redis().pipeline()
+    pipe.hset(batch_key(batch_id), mapping={
+        'state': 'PROGRESS',
+        'workflow_id': workflow_id,
+        'total': 0,
+        'dispatched': 0,
+        'completed': 0,
+        'failed': 0
+    })
+    pipe.expire(batch_key(batch_id), BATCH_TTL)
+    await pipe.execute()
+
+async def dispatch_batch(plan: WorkflowPlan, stream: AsyncIterator[bytes], options: Dict[str, Any],
+                         batch_id: str, concurrency: int) -> List[asyncio.Future]:
+    """
+    Reads an NDJSON request body as it arrives and starts the run of every line as soon
+    as the line is complete, with at most `concurrency` runs in flight. A line that
+    isn't a valid parameter set fails as its own item. Returns the items' futures.
+    """
+    semaphore = asyncio.Semaphore(max(1, min(concurrency, BATCH_MAX_CONCURRENCY)))
+    items = []
+
+    def start(line: bytes):
+        if line.strip():
+            items.append(asyncio.ensure_future(_run_item(plan, options, batch_id, len(items), line, semaphore)))
+
+    buffer = b''
+    try:
+        async for chunk in stream:
+            buffer += chunk
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                start(line)
+        start(buffer)
+    except BaseException:
+        # The upload broke off: don't leave the items started so far running unobserved
+        for item in items:
+            item.cancel()
+        raise
+    return items
+
+async def run_batch(items: List[asyncio.Future], batch_id: str) -> AsyncIterator[str]:
+    """
+    Yields an NDJSON line per item of a batch in completion order.
+    """
+    try:
+        for item in asyncio.as_completed(items):
+            yield json.dumps(await item) + '\n'
+        await get_async_redis().hset(batch_key(batch_id), 'state', 'SUCCESS')
+    finally:
+        # If the client went away, stop dispatching the items that haven't started yet
+        for item in items:
+            item.cancel()
@@ -0,0 +1,94 @@
+# backend/benchmarks/bench_async_db.py
+"""
+Shows how a slow database affects the latency of unrelated requests.
+
+Every SQL statement is slowed down by --query-delay seconds. While --concurrency
+clients keep listing workflows, a probe measures the latency of /api/health.
+The 'async' mode lists through the real GET /workflows handler, which uses the
+async session. The 'blocking' mode runs the same query through the synchronous
+session on the event loop, the way the handlers used to do.
+
+Runs in-process against a temporary SQLite database (needs aiosqlite).
+
+Usage: python benchmarks/bench_async_db.py [--query-delay 0.2] [--concurrency 20] [--duration 5]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+
+import httpx
+from sqlalchemy import event
+
+import database
+import main
+from database import Base, SessionLocal, WorkflowModel
+
+
+def slow_down(engine, delay):
+    # The delay has to happen where the driver runs the statement: the aiosqlite
+    # connection thread for the async engine, the calling thread for the sync one
+    @event.listens_for(engine, 'connect')
+    def add_delay(dbapi_connection, connection_record):
+        raw_connection = getattr(getattr(dbapi_connection, '_connection', None), '_conn', dbapi_connection)
+        raw_connection.set_trace_callback(lambda statement: time.sleep(delay))
+
+
+@main.app.get('/bench/blocking-workflows')
+async def list_workflows_blocking():
+    db = SessionLocal()
+    try:
+        return [row.id for row in db.query(WorkflowModel.id).limit(50).all()]
+    finally:
+        db.close()
+
+
+async def run_mode(path, args):
+    latencies = []
+    stop = time.monotonic() + args.duration
+
+    async with httpx.AsyncClient(app=main.app, base_url='http://bench') as client:
+        async def load():
+            while time.monotonic() < stop:
+                await client.get(path)
+
+        async def probe():
+            while time.monotonic() < stop:
+                started = time.perf_counter()
+                await client.get('/api/health')
+                latencies.append(time.perf_counter() - started)
+                await asyncio.sleep(0.05)
+
+        await asyncio.gather(probe(), *(load() for _ in range(args.concurrency)))
+
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.99) - 1], len(latencies)
+
+
+def run_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--query-delay', type=float, default=0.2, help='seconds added to every SQL statement')
+    parser.add_argument('--concurrency', type=int, default=20, help='clients listing workflows at once')
+    parser.add_argument('--duration', type=float, default=5, help='seconds per mode')
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=database.engine)
+    slow_down(database.engine, args.query_delay)
+    slow_down(database.get_async_engine().sync_engine, args.query_delay)
+
+    print(f"{'mode':>9} {'health p50 ms':>14} {'health p99 ms':>14} {'probes':>7}")
+    for mode, path in (('async', '/workflows'), ('blocking', '/bench/blocking-workflows')):
+        p50, p99, probes = asyncio.run(run_mode(path, args))
+        print(f"{mode:>9} {p50 * 1000:>14.1f} {p99 * 1000:>14.1f} {probes:>7}")
+
+
+if __name__ == '__main__':
+    run_benchmark()
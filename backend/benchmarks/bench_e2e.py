@@ -0,0 +1,312 @@
+# backend/benchmarks/bench_e2e.py
+"""
+End-to-end benchmark of workflow runs through the API.
+
+Starts the FastAPI app under uvicorn and a threaded Celery worker in this process,
+with OpenAI and Azure Blob Storage replaced by fakes that sleep for a configurable
+latency. Synthetic workflows of several shapes are submitted to /execute-workflow
+and followed over /ws/{task_id} until they finish:
+
+  linear  pairs of generateText -> displayText, run one node after another
+  fanout  one generateText feeding generateImage and textToSpeech nodes
+  deep    one generateText followed by a long chain of displayText nodes
+
+For every shape the benchmark reports throughput, p50/p99 run latency, Redis
+commands per run and the peak RSS of the process. Results are compared with
+benchmarks/baselines.json and the script exits with status 1 when a shape
+regressed by more than --tolerance. Use --save-baseline to record new baselines.
+Every baseline stores the parameters it was recorded with (workflow size, runs,
+concurrency, workers, fake latencies, Redis or in-memory); a shape run with other
+parameters is not compared.
+
+Without REDIS_URL everything runs in memory: fakeredis (optional package) replaces
+Redis, and Celery uses the in-memory broker and result backend.
+
+Usage: python benchmarks/bench_e2e.py [--shapes linear fanout deep] [--size 10]
+           [--runs 20] [--concurrency 5] [--provider-latency 0.05] [--save-baseline]
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+os.environ.setdefault(
+    'AZURE_STORAGE_CONNECTION_STRING',
+    'DefaultEndpointsProtocol=https;AccountName=benchmark;AccountKey=YmVuY2htYXJr;EndpointSuffix=core.windows.net'
+)
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+
+import httpx
+import redis
+import redis.asyncio
+import uvicorn
+import websockets
+from celery.contrib.testing.worker import start_worker
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+
+class RedisCommandCounter:
+    """Counts the Redis commands sent by every client in the process, pipelines included."""
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def add(self, amount):
+        with self._lock:
+            self.count += amount
+
+    def install(self):
+        counter = self
+
+        def wrap(cls, method, amount):
+            original = getattr(cls, method)
+
+            def counted(self, *args, **kwargs):
+                counter.add(amount(self))
+                return original(self, *args, **kwargs)
+
+            async def counted_async(self, *args, **kwargs):
+                counter.add(amount(self))
+                return await original(self, *args, **kwargs)
+
+            setattr(cls, method, counted_async if asyncio.iscoroutinefunction(original) else counted)
+
+        wrap(redis.client.Pipeline, 'execute', lambda pipe: len(pipe.command_stack))
+        wrap(redis.asyncio.client.Pipeline, 'execute', lambda pipe: len(pipe.command_stack))
+        wrap(redis.Redis, 'execute_command', lambda client: 1)
+        wrap(redis.asyncio.Redis, 'execute_command', lambda client: 1)
+
+
+class FakeOpenAI:
+    """Stands in for the OpenAI client, answering every call after `latency` seconds."""
+    def __init__(self, latency, text_size=400, audio_size=256 * 1024):
+        def create_completion(stream=False, **kwargs):
+            time.sleep(latency)
+            text = 'x' * text_size
+            if stream:
+                return iter([SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text[i:i + 20]))])
+                             for i in range(0, text_size, 20)])
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+        def generate_image(**kwargs):
+            time.sleep(latency)
+            return SimpleNamespace(data=[SimpleNamespace(url='https://images.invalid/generated.png')])
+
+        @contextmanager
+        def create_speech(**kwargs):
+            time.sleep(latency)
+            audio = b'\0' * audio_size
+            yield SimpleNamespace(iter_bytes=lambda size: (audio[i:i + size] for i in range(0, len(audio), size)))
+
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=create_completion))
+        self.images = SimpleNamespace(generate=generate_image)
+        self.audio = SimpleNamespace(speech=SimpleNamespace(
+            with_streaming_response=SimpleNamespace(create=create_speech)))
+
+
+class FakeContainer:
+    """Stands in for the blob container client, taking `latency` seconds per request."""
+    def __init__(self, latency):
+        self.latency = latency
+
+    def get_blob_client(self, filename):
+        latency = self.latency
+        return SimpleNamespace(
+            stage_block=lambda block_id, data: time.sleep(latency),
+            commit_block_list=lambda blocks: time.sleep(latency),
+            upload_blob=lambda data, overwrite=False: time.sleep(latency)
+        )
+
+
+def build_workflow(shape, size):
+    if shape == 'linear':
+        blocks = []
+        for i in range(size):
+            blocks.append({'id': f'text-{i}', 'type': 'generateText', 'inputs': {}, 'data': {'prompt': f'prompt {i}'}})
+            blocks.append({'id': f'display-{i}', 'type': 'displayText', 'inputs': {'input': f'text-{i}'}, 'data': {}})
+        return {'blocks': blocks, 'parallel': False}
+    if shape == 'fanout':
+        blocks = [{'id': 'text', 'type': 'generateText', 'inputs': {}, 'data': {'prompt': 'prompt'}}]
+        for i in range(size):
+            blocks.append({'id': f'image-{i}', 'type': 'generateImage', 'inputs': {'input': 'text'}, 'data': {}})
+            blocks.append({'id': f'speech-{i}', 'type': 'textToSpeech', 'inputs': {'input': 'text'}, 'data': {}})
+        return {'blocks': blocks, 'parallel': True}
+    if shape == 'deep':
+        blocks = [{'id': 'display-0', 'type': 'generateText', 'inputs': {}, 'data': {'prompt': 'prompt'}}]
+        for i in range(1, size * 2):
+            blocks.append({'id': f'display-{i}', 'type': 'displayText', 'inputs': {'input': f'display-{i - 1}'}, 'data': {}})
+        return {'blocks': blocks, 'parallel': True}
+    raise ValueError(f"Unknown shape {shape}")
+
+
+async def run_once(base_url, workflow):
+    started = time.perf_counter()
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        response = await client.post('/execute-workflow', json=dict(workflow, use_cache=False, incremental=False))
+        response.raise_for_status()
+        task_id = response.json()['task_id']
+
+    async with websockets.connect(f"{base_url.replace('http', 'ws')}/ws/{task_id}") as websocket:
+        async for message in websocket:
+            event = json.loads(message)
+            if event.get('state') in ('SUCCESS', 'FAILURE'):
+                if event['state'] != 'SUCCESS':
+                    raise RuntimeError(f"Run {task_id} failed: {event}")
+                break
+    return time.perf_counter() - started
+
+
+async def run_shape(base_url, workflow, runs, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited():
+        async with semaphore:
+            return await run_once(base_url, workflow)
+
+    started = time.perf_counter()
+    latencies = sorted(await asyncio.gather(*(limited() for _ in range(runs))))
+    return time.perf_counter() - started, latencies
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_parameters(args):
+    return {
+        'size': args.size,
+        'runs': args.runs,
+        'concurrency': args.concurrency,
+        'workers': args.workers,
+        'provider_latency': args.provider_latency,
+        'storage_latency': args.storage_latency,
+        'redis': 'redis' if os.getenv('REDIS_URL') else 'memory'
+    }
+
+
+def compare(shape, result, baseline, tolerance):
+    regressions = []
+    if result['p50_ms'] > baseline['p50_ms'] * (1 + tolerance):
+        regressions.append(f"p50 {result['p50_ms']:.0f}ms vs {baseline['p50_ms']:.0f}ms")
+    if result['runs_per_s'] < baseline['runs_per_s'] * (1 - tolerance):
+        regressions.append(f"throughput {result['runs_per_s']:.2f}/s vs {baseline['runs_per_s']:.2f}/s")
+    if result['redis_ops_per_run'] > baseline['redis_ops_per_run'] * (1 + tolerance):
+        regressions.append(f"Redis ops {result['redis_ops_per_run']:.0f} vs {baseline['redis_ops_per_run']:.0f} per run")
+    return [f"{shape}: {regression}" for regression in regressions]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shapes', nargs='+', default=['linear', 'fanout', 'deep'])
+    parser.add_argument('--size', type=int, default=10, help='nodes per shape, roughly halved')
+    parser.add_argument('--runs', type=int, default=20, help='runs per shape')
+    parser.add_argument('--concurrency', type=int, default=5, help='runs in flight at once')
+    parser.add_argument('--workers', type=int, default=8, help='Celery worker threads')
+    parser.add_argument('--provider-latency', type=float, default=0.05, help='seconds per fake OpenAI call')
+    parser.add_argument('--storage-latency', type=float, default=0.005, help='seconds per fake blob request')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative regression')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baselines')
+    args = parser.parse_args()
+
+    import redis_client
+    from celery_app import celery_app
+    if not os.getenv('REDIS_URL'):
+        try:
+            import fakeredis
+        except ImportError:
+            sys.exit("Set REDIS_URL or install fakeredis to run the benchmark.")
+        server = fakeredis.FakeServer()
+        redis_client._redis = fakeredis.FakeRedis(server=server)
+        redis_client._async_redis = fakeredis.FakeAsyncRedis(server=server)
+        # The in-memory transport polls its queues, by default once a second, and its
+        # blocking consumer stalls for seconds whenever the prefetch window is full
+        celery_app.conf.update(broker_url='memory://', result_backend='cache+memory://',
+                               broker_transport_options={'polling_interval': 0.005},
+                               worker_prefetch_multiplier=64)
+
+    import azure_storage
+    import database
+    import main as app_module
+    import rate_limiter
+    import tasks
+
+    database.Base.metadata.create_all(bind=database.engine)
+    tasks.client = FakeOpenAI(args.provider_latency)
+    azure_storage._container_client = FakeContainer(args.storage_latency)
+    # The fakes have no quota to protect
+    rate_limiter.RATE_LIMITS = {}
+
+    counter = RedisCommandCounter()
+    counter.install()
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app_module.app, host='127.0.0.1', port=port, log_level='warning'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    base_url = f"http://127.0.0.1:{port}"
+
+    baselines = {}
+    if os.path.exists(BASELINES_PATH):
+        with open(BASELINES_PATH) as f:
+            baselines = json.load(f)
+
+    results = {}
+    print(f"{'shape':>8} {'runs/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'redis/run':>10} {'peak RSS MB':>12}")
+    with start_worker(celery_app, pool='threads', concurrency=args.workers, perform_ping_check=False, loglevel='WARNING'):
+        for shape in args.shapes:
+            workflow = build_workflow(shape, args.size)
+            commands_before = counter.count
+            elapsed, latencies = asyncio.run(run_shape(base_url, workflow, args.runs, args.concurrency))
+            results[shape] = {
+                'runs_per_s': args.runs / elapsed,
+                'p50_ms': statistics.median(latencies) * 1000,
+                'p99_ms': latencies[max(0, int(len(latencies) * 0.99) - 1)] * 1000,
+                'redis_ops_per_run': (counter.count - commands_before) / args.runs,
+                'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            }
+            r = results[shape]
+            print(f"{shape:>8} {r['runs_per_s']:>8.2f} {r['p50_ms']:>8.0f} {r['p99_ms']:>8.0f} "
+                  f"{r['redis_ops_per_run']:>10.0f} {r['peak_rss_mb']:>12.0f}")
+    server.should_exit = True
+
+    parameters = run_parameters(args)
+    if args.save_baseline:
+        baselines.update({shape: dict({name: round(value, 2) for name, value in result.items()}, parameters=parameters)
+                          for shape, result in results.items()})
+        with open(BASELINES_PATH, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"Baselines saved to {BASELINES_PATH}")
+        return
+
+    regressions = []
+    for shape, result in results.items():
+        if shape not in baselines:
+            continue
+        if baselines[shape].get('parameters') != parameters:
+            print(f"{shape}: not compared, the baseline was recorded with {baselines[shape].get('parameters')}")
+            continue
+        regressions += compare(shape, result, baselines[shape], args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
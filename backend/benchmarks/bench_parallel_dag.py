@@ -0,0 +1,127 @@
+# backend/benchmarks/bench_parallel_dag.py
+"""
+Compares linear and level-parallel execution of wide workflows.
+
+The OpenAI client in tasks.py is replaced with a stub that sleeps for a fixed
+latency, and a thread pool stands in for a pool of Celery workers. Each level
+returned by get_execution_levels runs concurrently, exactly as the group/chord
+canvas built by execute_workflow does on real workers.
+
+Usage: python benchmarks/bench_parallel_dag.py [--width 8] [--latency 0.2] [--workers 8]
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+os.environ.setdefault(
+    'AZURE_STORAGE_CONNECTION_STRING',
+    'DefaultEndpointsProtocol=https;AccountName=benchmark;AccountKey=YmVuY2htYXJr;EndpointSuffix=core.windows.net'
+)
+
+import tasks
+from workflow_executor import TASK_MAPPING, build_edges, build_task_signature, get_execution_levels, topological_sort
+
+logging.getLogger().setLevel(logging.WARNING)
+
+
+class StubCompletions:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def create(self, model, messages, **kwargs):
+        time.sleep(self.latency)
+        message = SimpleNamespace(content=f"stub reply to: {messages[-1]['content']}")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class StubImages:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def generate(self, model, prompt, **kwargs):
+        time.sleep(self.latency)
+        return SimpleNamespace(data=[SimpleNamespace(url='https://example.invalid/image.png')])
+
+
+class StubClient:
+    def __init__(self, latency):
+        self.chat = SimpleNamespace(completions=StubCompletions(latency))
+        self.images = StubImages(latency)
+
+
+def wide_workflow(width):
+    """Independent generateText -> generateImage -> displayImage branches."""
+    blocks = []
+    for i in range(width):
+        blocks.append({'id': f'text-{i}', 'type': 'generateText', 'inputs': {}, 'data': {'prompt': f'prompt {i}'}})
+        blocks.append({'id': f'image-{i}', 'type': 'generateImage', 'inputs': {'input': f'text-{i}'}, 'data': {}})
+        blocks.append({'id': f'display-{i}', 'type': 'displayImage', 'inputs': {'input': f'image-{i}'}, 'data': {}})
+    return blocks
+
+
+def run_node(block, accumulated_results):
+    signature = build_task_signature(block, use_cache=False)
+    return tasks.celery_app.tasks[TASK_MAPPING[block['type']]].run(dict(accumulated_results), **signature.kwargs)
+
+
+def run_linear(blocks):
+    blocks_by_id = {block['id']: block for block in blocks}
+    accumulated_results = tasks.start_workflow.run()
+    for node_id in topological_sort(blocks, build_edges(blocks)):
+        accumulated_results = run_node(blocks_by_id[node_id], accumulated_results)
+    return accumulated_results
+
+
+def run_parallel(blocks, workers):
+    blocks_by_id = {block['id']: block for block in blocks}
+    accumulated_results = tasks.start_workflow.run()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for level in get_execution_levels(blocks, build_edges(blocks)):
+            results_list = list(pool.map(lambda node_id: run_node(blocks_by_id[node_id], accumulated_results), level))
+            accumulated_results = tasks.merge_results.run(results_list)
+    return accumulated_results
+
+
+def comparable(accumulated_results):
+    """Drops the expiry times of URL outputs, which are stamped with the time the node ran."""
+    return {
+        node_id: {key: value for key, value in output.items() if key != 'expires_at'} if isinstance(output, dict) else output
+        for node_id, output in accumulated_results.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--width', type=int, default=8, help='number of independent branches')
+    parser.add_argument('--latency', type=float, default=0.2, help='stubbed provider latency in seconds')
+    parser.add_argument('--workers', type=int, default=8, help='simulated Celery workers')
+    args = parser.parse_args()
+
+    tasks.client = StubClient(args.latency)
+    blocks = wide_workflow(args.width)
+
+    started = time.perf_counter()
+    linear_results = run_linear(blocks)
+    linear_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    parallel_results = run_parallel(blocks, args.workers)
+    parallel_elapsed = time.perf_counter() - started
+
+    assert comparable(linear_results) == comparable(parallel_results), "parallel execution produced different results"
+
+    print(f"blocks: {len(blocks)}  width: {args.width}  latency: {args.latency}s  workers: {args.workers}")
+    print(f"linear:   {linear_elapsed:.3f}s")
+    print(f"parallel: {parallel_elapsed:.3f}s")
+    print(f"speedup:  {linear_elapsed / parallel_elapsed:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# backend/benchmarks/bench_result_passing.py
+"""
+Compares inline and by-reference result passing over long linear workflows.
+
+Every hop of a Celery chain serializes the accumulated results once into the
+result backend and once into the next task message. This benchmark runs the
+real task functions with a stubbed OpenAI client, round-trips the accumulated
+results through JSON at every hop the way Celery does, and reports the bytes
+shipped and the time spent.
+
+By-reference mode needs Redis: REDIS_URL is used when set, otherwise the
+optional fakeredis package provides an in-memory server.
+
+Usage: python benchmarks/bench_result_passing.py [--nodes 50 200] [--text-size 2000]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+os.environ.setdefault(
+    'AZURE_STORAGE_CONNECTION_STRING',
+    'DefaultEndpointsProtocol=https;AccountName=benchmark;AccountKey=YmVuY2htYXJr;EndpointSuffix=core.windows.net'
+)
+
+import redis_client
+import tasks
+from workflow_executor import TASK_MAPPING, build_edges, build_task_signature, topological_sort
+
+logging.getLogger().setLevel(logging.WARNING)
+
+
+class StubClient:
+    def __init__(self, text_size):
+        reply = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content='x' * text_size))])
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=lambda **kwargs: reply))
+
+
+def linear_workflow(nodes):
+    """Alternating generateText -> displayText blocks chained one after another."""
+    blocks = []
+    for i in range(nodes // 2):
+        blocks.append({'id': f'text-{i}', 'type': 'generateText', 'inputs': {}, 'data': {'prompt': f'prompt {i}'}})
+        blocks.append({'id': f'display-{i}', 'type': 'displayText', 'inputs': {'input': f'text-{i}'}, 'data': {}})
+    return blocks
+
+
+def run_chain(blocks, by_reference):
+    run_id = str(uuid.uuid4())
+    blocks_by_id = {block['id']: block for block in blocks}
+    shipped_bytes = 0
+    serialization_time = 0.0
+
+    started = time.perf_counter()
+    accumulated_results = tasks.start_workflow.run()
+    for node_id in topological_sort(blocks, build_edges(blocks)):
+        signature = build_task_signature(blocks_by_id[node_id], run_id, use_cache=False, by_reference=by_reference)
+        accumulated_results = tasks.celery_app.tasks[TASK_MAPPING[blocks_by_id[node_id]['type']]].run(accumulated_results, **signature.kwargs)
+
+        # Result backend write plus the argument of the next task message
+        hop_started = time.perf_counter()
+        for _ in range(2):
+            payload = json.dumps(accumulated_results)
+            shipped_bytes += len(payload)
+            accumulated_results = json.loads(payload)
+        serialization_time += time.perf_counter() - hop_started
+
+    final_results = tasks.finish_workflow.run(accumulated_results)
+    elapsed = time.perf_counter() - started
+    return final_results, shipped_bytes, serialization_time, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, nargs='+', default=[50, 200], help='workflow sizes to run')
+    parser.add_argument('--text-size', type=int, default=2000, help='characters per generated text')
+    args = parser.parse_args()
+
+    if not os.getenv('REDIS_URL'):
+        try:
+            import fakeredis
+        except ImportError:
+            sys.exit("Set REDIS_URL or install fakeredis to run the by-reference mode.")
+        redis_client._redis = fakeredis.FakeRedis()
+
+    tasks.client = StubClient(args.text_size)
+
+    print(f"{'nodes':>6} {'mode':>10} {'shipped MB':>11} {'serialize s':>12} {'total s':>8}")
+    for nodes in args.nodes:
+        blocks = linear_workflow(nodes)
+        inline = run_chain(blocks, by_reference=False)
+        by_ref = run_chain(blocks, by_reference=True)
+        assert inline[0] == by_ref[0], "result passing modes produced different results"
+
+        for mode, (_, shipped_bytes, serialization_time, elapsed) in (('inline', inline), ('reference', by_ref)):
+            print(f"{nodes:>6} {mode:>10} {shipped_bytes / 1e6:>11.2f} {serialization_time:>12.3f} {elapsed:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# backend/benchmarks/bench_startup.py
+"""
+Measures the cold import time of the API and the worker with `python -X importtime`.
+
+Each entry point is imported --repeat times in a fresh interpreter; the median
+cumulative import time is reported together with the slowest modules it pulled in.
+The API must not import the provider SDKs or the task module, which only workers
+need: the script exits with status 1 when `main` loads any of them, or when an
+entry point takes longer than --max-ms.
+
+Usage: python benchmarks/bench_startup.py [--repeat 5] [--top 10] [--max-ms 0]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+ENTRY_POINTS = {
+    'api': 'main',
+    'worker': 'tasks',
+}
+
+# Modules only the workers use; loading them slows down every API cold start
+API_FORBIDDEN_MODULES = ('tasks', 'openai', 'azure.storage.blob')
+
+IMPORT_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+ENV = dict(
+    os.environ,
+    OPENAI_API_KEY=os.getenv('OPENAI_API_KEY', 'benchmark'),
+    AZURE_STORAGE_CONNECTION_STRING=os.getenv(
+        'AZURE_STORAGE_CONNECTION_STRING',
+        'DefaultEndpointsProtocol=https;AccountName=benchmark;AccountKey=YmVuY2htYXJr;EndpointSuffix=core.windows.net'
+    ),
+    DATABASE_URL=os.getenv('DATABASE_URL', 'sqlite://'),
+)
+
+
+def import_profile(module):
+    """Returns {module: cumulative microseconds} for one cold import of `module`."""
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=BACKEND_DIR, env=ENV, capture_output=True, text=True, check=True
+    )
+    cumulative = {}
+    for line in completed.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            cumulative[match.group(4)] = int(match.group(2))
+    return cumulative
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='cold imports per entry point')
+    parser.add_argument('--top', type=int, default=10, help='slowest modules to list')
+    parser.add_argument('--max-ms', type=float, default=0, help='fail above this import time (0 disables)')
+    args = parser.parse_args()
+
+    failures = []
+    for name, module in ENTRY_POINTS.items():
+        profiles = [import_profile(module) for _ in range(args.repeat)]
+        total_ms = statistics.median(profile[module] for profile in profiles) / 1000
+        print(f"{name} ({module}): {total_ms:.0f} ms")
+
+        last = profiles[-1]
+        for imported, micros in sorted(last.items(), key=lambda item: -item[1])[1:args.top + 1]:
+            print(f"  {micros / 1000:>8.0f} ms  {imported}")
+
+        if args.max_ms and total_ms > args.max_ms:
+            failures.append(f"{name} imports in {total_ms:.0f} ms, above {args.max_ms:.0f} ms")
+        if name == 'api':
+            loaded = [forbidden for forbidden in API_FORBIDDEN_MODULES if forbidden in last]
+            if loaded:
+                failures.append(f"the API imports worker-only modules: {', '.join(loaded)}")
+
+    for failure in failures:
+        print(f"FAILED {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+# backend/benchmarks/bench_websocket_fanout.py
+"""
+Load test of progress fan-out to thousands of WebSocket viewers.
+
+--sockets simulated sockets watch one run, spread over --replicas connection
+managers that each run their own Redis progress listener, like API replicas behind
+a load balancer. Progress events are published to Redis the way workers publish
+them, and every manager relays them to its own sockets. A simulated socket takes
+--latency seconds to send an event; a --slow fraction of them takes --slow-latency.
+
+Two delivery modes are compared:
+
+  serial  every event is awaited on one socket after another (the previous
+          ConnectionManager.send_update), so a slow socket delays all the others
+  queued  every socket has its own bounded send queue and sender task
+
+For each mode the benchmark reports the p50/p99 time from publishing an event to
+its arrival at the fast sockets, the time until every fast socket has every event,
+and how many slow sockets were dropped.
+
+Without REDIS_URL, fakeredis (optional package) replaces Redis.
+
+Usage: python benchmarks/bench_websocket_fanout.py [--sockets 5000] [--replicas 2] [--events 10]
+           [--latency 0] [--slow 0.002] [--slow-latency 0.5]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+class SimulatedSocket:
+    def __init__(self, latency):
+        self.latency = latency
+        self.received = 0
+        self.latencies = []
+        self.closed = False
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, data):
+        json.dumps(data)
+        await asyncio.sleep(self.latency)
+        self.received += 1
+        if 'sent_at' in data:
+            self.latencies.append(time.perf_counter() - data['sent_at'])
+
+    async def close(self, code=1000):
+        self.closed = True
+
+
+def serial_manager_class():
+    from websocket_manager import ConnectionManager
+
+    class SerialConnectionManager(ConnectionManager):
+        async def send_update(self, workflow_id, data):
+            for viewer in list(self.active_connections.get(workflow_id, ())):
+                await viewer.websocket.send_json(data)
+
+    return SerialConnectionManager
+
+
+async def run_mode(manager_class, args):
+    from progress import publish_progress
+
+    run_id = str(uuid.uuid4())
+    managers = [manager_class() for _ in range(args.replicas)]
+    for manager in managers:
+        await manager.start_listener()
+
+    slow_every = int(1 / args.slow) if args.slow else 0
+    sockets, viewers = [], []
+    for index in range(args.sockets):
+        slow = slow_every and index % slow_every == 0
+        websocket = SimulatedSocket(args.slow_latency if slow else args.latency)
+        websocket.slow = slow
+        sockets.append(websocket)
+        viewers.append(await managers[index % args.replicas].connect(websocket, run_id))
+    # Let the listeners subscribe before the first event is published
+    await asyncio.sleep(0.2)
+
+    fast = [websocket for websocket in sockets if not websocket.slow]
+    started = time.perf_counter()
+    for index in range(args.events):
+        state = 'SUCCESS' if index == args.events - 1 else 'PROGRESS'
+        publish_progress(run_id, {'state': state, 'node_id': f'node-{index}', 'status': 'SUCCESS',
+                                  'result': {'text': 'x' * 200}, 'sent_at': time.perf_counter()})
+        await asyncio.sleep(args.interval)
+    while any(websocket.received < args.events for websocket in fast):
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+
+    for viewer in viewers:
+        viewer.stop()
+    for manager in managers:
+        await manager.stop_listener()
+
+    latencies = sorted(latency for websocket in fast for latency in websocket.latencies)
+    return {
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        'elapsed': elapsed,
+        'dropped': sum(1 for websocket in sockets if websocket.closed),
+        'slow': len(sockets) - len(fast)
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sockets', type=int, default=5000, help='simulated viewers of the run')
+    parser.add_argument('--replicas', type=int, default=2, help='API replicas the viewers are spread over')
+    parser.add_argument('--events', type=int, default=10, help='progress events published for the run')
+    parser.add_argument('--interval', type=float, default=0.05, help='seconds between events')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds a socket takes to send one event')
+    parser.add_argument('--slow', type=float, default=0.002, help='fraction of slow sockets')
+    parser.add_argument('--slow-latency', type=float, default=0.5, help='seconds a slow socket takes per event')
+    args = parser.parse_args()
+
+    import redis_client
+    if not os.getenv('REDIS_URL'):
+        try:
+            import fakeredis
+        except ImportError:
+            sys.exit("Set REDIS_URL or install fakeredis to run the benchmark.")
+        server = fakeredis.FakeServer()
+        redis_client._redis = fakeredis.FakeRedis(server=server)
+        redis_client._async_redis = fakeredis.FakeAsyncRedis(server=server)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    from websocket_manager import ConnectionManager
+
+    print(f"{args.sockets} sockets over {args.replicas} replicas, {args.events} events")
+    print(f"{'mode':>8} {'p50 ms':>9} {'p99 ms':>9} {'all fast s':>11} {'slow':>6} {'dropped':>8}")
+    for mode, manager_class in (('serial', serial_manager_class()), ('queued', ConnectionManager)):
+        result = await run_mode(manager_class, args)
+        print(f"{mode:>8} {result['p50_ms']:>9.1f} {result['p99_ms']:>9.1f} {result['elapsed']:>11.2f} "
+              f"{result['slow']:>6} {result['dropped']:>8}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
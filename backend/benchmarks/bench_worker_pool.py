@@ -0,0 +1,134 @@
+# backend/benchmarks/bench_worker_pool.py
+"""
+Compares provider-bound throughput of the prefork and gevent worker pools.
+
+A fake OpenAI chat completions endpoint (see fake_provider) answers every
+request after --latency seconds. generate_text tasks are then run the way each
+Celery pool runs them:
+
+  prefork  --processes worker processes, each running one task at a time
+  gevent   one process running --greenlets tasks at a time, monkey patched like
+           `celery worker -P gevent`, sharing the process's pooled OpenAI client
+
+Each mode runs in a fresh interpreter. The benchmark reports completions per
+second, completions per second per process, and the combined peak RSS.
+
+Without REDIS_URL, fakeredis (optional package) replaces Redis.
+
+Usage: python benchmarks/bench_worker_pool.py [--tasks 500] [--processes 4] [--greenlets 100] [--latency 1.0]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+os.environ.setdefault(
+    'AZURE_STORAGE_CONNECTION_STRING',
+    'DefaultEndpointsProtocol=https;AccountName=benchmark;AccountKey=YmVuY2htYXJr;EndpointSuffix=core.windows.net'
+)
+
+
+def load_tasks():
+    import logging
+    import redis_client
+    if not os.getenv('REDIS_URL'):
+        try:
+            import fakeredis
+        except ImportError:
+            sys.exit("Set REDIS_URL or install fakeredis to run the benchmark.")
+        redis_client._redis = fakeredis.FakeRedis()
+
+    import rate_limiter
+    import tasks
+    logging.getLogger().setLevel(logging.WARNING)
+    # The fake provider has no quota to protect
+    rate_limiter.RATE_LIMITS = {}
+    return tasks
+
+
+def run_task(index):
+    import tasks
+    result = tasks.generate_text.run({}, f'text-{index}', prompt=f'prompt {index}', use_cache=False)
+    assert 'error' not in result[f'text-{index}'], result[f'text-{index}']
+
+
+def run_prefork(count, processes):
+    with multiprocessing.Pool(processes, initializer=load_tasks) as pool:
+        started = time.perf_counter()
+        # chunksize=1 hands out one task at a time, like worker_prefetch_multiplier=1
+        pool.map(run_task, range(count), chunksize=1)
+        elapsed = time.perf_counter() - started
+    # The largest worker process times the number of processes
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {'elapsed': elapsed, 'processes': processes, 'peak_rss_mb': children * processes / 1024}
+
+
+def run_gevent(count, greenlets):
+    from gevent import monkey
+    monkey.patch_all()
+    from gevent.pool import Pool
+
+    load_tasks()
+    pool = Pool(greenlets)
+    started = time.perf_counter()
+    pool.map(run_task, range(count))
+    elapsed = time.perf_counter() - started
+    return {'elapsed': elapsed, 'processes': 1,
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tasks', type=int, default=500, help='generate_text tasks per mode')
+    parser.add_argument('--processes', type=int, default=4, help='prefork worker processes')
+    parser.add_argument('--greenlets', type=int, default=100, help='gevent concurrency of one process')
+    parser.add_argument('--latency', type=float, default=1.0, help='seconds per fake completion')
+    parser.add_argument('--mode', choices=['prefork', 'gevent'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode == 'prefork':
+        print(json.dumps(run_prefork(args.tasks, args.processes)))
+        return
+    if args.mode == 'gevent':
+        print(json.dumps(run_gevent(args.tasks, args.greenlets)))
+        return
+
+    import httpx
+    from fake_provider import free_port, serve_provider
+
+    port = free_port()
+    provider = multiprocessing.Process(target=serve_provider, args=(args.latency, port), daemon=True)
+    provider.start()
+    provider_url = f'http://127.0.0.1:{port}'
+    while True:
+        try:
+            httpx.get(f'{provider_url}/stats')
+            break
+        except httpx.TransportError:
+            time.sleep(0.05)
+    env = dict(os.environ, OPENAI_BASE_URL=f'{provider_url}/v1')
+
+    print(f"{'mode':>8} {'procs':>6} {'tasks/s':>9} {'per proc':>9} {'peak RSS MB':>12}")
+    for mode in ('prefork', 'gevent'):
+        completed = subprocess.run(
+            [sys.executable, __file__, '--mode', mode, '--tasks', str(args.tasks),
+             '--processes', str(args.processes), '--greenlets', str(args.greenlets)],
+            env=env, capture_output=True, text=True, check=True
+        )
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        rate = args.tasks / result['elapsed']
+        print(f"{mode:>8} {result['processes']:>6} {rate:>9.1f} {rate / result['processes']:>9.1f} "
+              f"{result['peak_rss_mb']:>12.0f}")
+    provider.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+# backend/benchmarks/fake_provider.py
+"""
+A fake OpenAI chat completions endpoint for the benchmarks. It answers every request
+after a fixed latency and counts the requests and connections it saw (GET /stats).
+Run it in its own process with serve_provider so it doesn't compete with the code
+under test for the GIL.
+"""
+import asyncio
+import socket
+import time
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def fake_provider(latency):
+    from fastapi import FastAPI, Request
+
+    app = FastAPI()
+    stats = {'requests': 0, 'connections': set()}
+
+    @app.post('/v1/chat/completions')
+    async def create_completion(request: Request):
+        body = await request.json()
+        stats['requests'] += 1
+        stats['connections'].add((request.client.host, request.client.port))
+        await asyncio.sleep(latency)
+        return {
+            'id': 'chatcmpl-benchmark', 'object': 'chat.completion', 'created': int(time.time()), 'model': body['model'],
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': f"reply to {body['messages'][-1]['content']}"}}],
+            'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2}
+        }
+
+    @app.post('/stats/reset')
+    async def reset_stats():
+        stats['requests'] = 0
+        stats['connections'] = set()
+
+    @app.get('/stats')
+    async def read_stats():
+        return {'requests': stats['requests'], 'connections': len(stats['connections'])}
+
+    return app
+
+
+def serve_provider(latency, port):
+    import uvicorn
+    uvicorn.run(fake_provider(latency), host='127.0.0.1', port=port, log_level='warning')
@@ -1,13 +1,26 @@
 # backend/celery_app.py
 import os
 from celery import Celery
+from celery.signals import worker_init
+from kombu import Queue
 
 import logging
-logging.basicConfig(level=logging.DEBUG)
+# DEBUG makes every library log every request; set LOG_LEVEL=DEBUG when that is wanted
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper())
 
 REDIS_URL = os.getenv('REDIS_URL')
 print(f"REDIS_URL: {REDIS_URL}")
 
+# Provider calls take seconds; everything else takes milliseconds and must not queue behind them
+LIGHT_QUEUE = 'light'
+HEAVY_QUEUE = 'heavy'
+
+# Lower runs first. Batch runs and runs of tenants over their share yield to interactive ones.
+RUN_PRIORITIES = {
+    'interactive': 0,
+    'bulk': 9,
+}
+
 # Initialize Celery
 celery_app = Celery(
     'ai_automation_tool',
@@ -27,4 +40,33 @@ celery_app.conf.update(
     worker_prefetch_multiplier=1,
     task_acks_late=True,
     task_reject_on_worker_lost=True,
+    task_queues=(Queue(LIGHT_QUEUE), Queue(HEAVY_QUEUE)),
+    task_default_queue=LIGHT_QUEUE,
+    task_routes={
+        'tasks.generate_text': {'queue': HEAVY_QUEUE},
+        'tasks.generate_image': {'queue': HEAVY_QUEUE},
+        'tasks.text_to_speech': {'queue': HEAVY_QUEUE},
+    },
+    # Priorities are emulated on Redis with one list per step
+    broker_transport_options={
+        'priority_steps': list(range(10)),
+        'sep': ':',
+        'queue_order_strategy': 'priority',
+    },
+    task_inherit_parent_priority=True,
 )
+
+@worker_init.connect
+def patch_psycopg_for_gevent(**kwargs):
+    """
+    Under the gevent pool (-P gevent) psycopg2 would block the whole hub, and with it
+    every task of the worker, while one task waits on the database (run history is
+    written from finish_workflow). psycogreen makes it yield to the other greenlets.
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return
+    if monkey.is_module_patched('socket'):
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
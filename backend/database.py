@@ -1,14 +1,37 @@
-from sqlalchemy import create_engine, Column, Integer, String, JSON, DateTime
+from sqlalchemy import create_engine, Column, Integer, String, JSON, DateTime, Float, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 import os
 
 SQLALCHEMY_DATABASE_URL = os.getenv('DATABASE_URL')
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# Connection pool shared by the requests of one process
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+
+def to_async_url(url: str) -> str:
+    """
+    Maps DATABASE_URL onto the asyncio driver of the same database (asyncpg or aiosqlite).
+    """
+    for sync_prefix, async_prefix in (('postgresql+psycopg2://', 'postgresql+asyncpg://'),
+                                      ('postgresql://', 'postgresql+asyncpg://'),
+                                      ('postgres://', 'postgresql+asyncpg://'),
+                                      ('sqlite://', 'sqlite+aiosqlite://')):
+        if url.startswith(sync_prefix):
+            return async_prefix + url[len(sync_prefix):]
+    return url
+
+ASYNC_DATABASE_URL = os.getenv('ASYNC_DATABASE_URL') or to_async_url(SQLALCHEMY_DATABASE_URL or '')
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, pool_pre_ping=DB_POOL_PRE_PING)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+_async_engine = None
+_async_session_factory = None
+
 class WorkflowModel(Base):
     __tablename__ = "workflows"
 
@@ -16,7 +39,47 @@ class WorkflowModel(Base):
     name = Column(String, index=True)
     description = Column(String, nullable=True)
     workflow_json = Column(JSON)
-    created_at = Column(DateTime)
+    created_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        # Serves the keyset pagination of the workflow list
+        Index('ix_workflows_created_at_id', 'created_at', 'id'),
+    )
+
+class WorkflowRunModel(Base):
+    __tablename__ = "workflow_runs"
+
+    # The run_id the run was dispatched with, which is also its task id
+    id = Column(String, primary_key=True)
+    workflow_id = Column(Integer, ForeignKey('workflows.id', ondelete='CASCADE'), nullable=True)
+    status = Column(String)
+    node_count = Column(Integer)
+    failed_count = Column(Integer)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    __table_args__ = (
+        # Serves the run history of a saved workflow, newest first
+        Index('ix_workflow_runs_workflow_id_started_at', 'workflow_id', 'started_at'),
+    )
+
+class NodeResultModel(Base):
+    __tablename__ = "node_results"
+
+    id = Column(Integer, primary_key=True)
+    run_id = Column(String, ForeignKey('workflow_runs.id', ondelete='CASCADE'), nullable=False, index=True)
+    node_id = Column(String)
+    task_type = Column(String)
+    status = Column(String)
+    cache = Column(String, nullable=True)
+    # Final output of the node: text, or the URLs of generated images and audio
+    output = Column(JSON)
+    error = Column(String, nullable=True)
+    # Fingerprint of the node in the plan that ran it (see node_snapshots), to resume from
+    fingerprint = Column(String, nullable=True)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    duration_ms = Column(Float)
 
 #Base.metadata.create_all(bind=engine)
 
@@ -26,3 +89,24 @@ def get_db():
         yield db
     finally:
         db.close()
+
+def get_async_engine() -> AsyncEngine:
+    """
+    Returns the engine used by the API handlers, creating it on first use so processes
+    that never query asynchronously (the Celery workers) don't need the async drivers.
+    """
+    global _async_engine
+    if _async_engine is None:
+        pool_options = {'pool_pre_ping': DB_POOL_PRE_PING}
+        # SQLite connections are not pooled by the aiosqlite dialect
+        if not ASYNC_DATABASE_URL.startswith('sqlite'):
+            pool_options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+        _async_engine = create_async_engine(ASYNC_DATABASE_URL, **pool_options)
+    return _async_engine
+
+async def get_async_db():
+    global _async_session_factory
+    if _async_session_factory is None:
+        _async_session_factory = async_sessionmaker(get_async_engine(), autoflush=False, expire_on_commit=False)
+    async with _async_session_factory() as db:
+        yield db
@@ -0,0 +1,81 @@
+# backend/fair_share.py
+import logging
+import os
+import time
+from typing import Optional
+from redis_client import get_redis
+
+INFLIGHT_KEY_PREFIX = 'tenant-inflight:'
+# Every dispatched run, whatever its tenant, scored by lease expiry like the tenant sets
+RUNS_INFLIGHT_KEY = 'runs-inflight'
+# Runs a tenant may have in flight before further runs are held back (batches) or demoted (interactive)
+TENANT_MAX_INFLIGHT_RUNS = int(os.getenv('TENANT_MAX_INFLIGHT_RUNS', '20'))
+# A run that never reports back stops counting against its tenant after this long
+INFLIGHT_LEASE = int(os.getenv('TENANT_INFLIGHT_LEASE', '900'))
+
+logger = logging.getLogger(__name__)
+
+# Drops expired leases, then registers the run if the tenant is below its cap
+_ACQUIRE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[4])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return 1
+"""
+
+_acquire_script = None
+
+def inflight_key(tenant: str) -> str:
+    return f"{INFLIGHT_KEY_PREFIX}{tenant}"
+
+def tenant_for(tenant: Optional[str], workflow_id: Optional[int]) -> Optional[str]:
+    """
+    Runs are accounted to the caller's tenant, or to their saved workflow when the
+    caller didn't name a tenant. Runs with neither (such as the editor's runs of an
+    unsaved workflow) have no tenant and are never held back or demoted: pooling them
+    under one shared tenant would let unrelated users push each other to bulk priority.
+    """
+    if tenant:
+        return tenant
+    return f"workflow:{workflow_id}" if workflow_id is not None else None
+
+def try_acquire(tenant: str, run_id: str) -> bool:
+    """
+    Counts a run against its tenant unless the tenant is at TENANT_MAX_INFLIGHT_RUNS.
+    Returns whether the run got a slot; every call succeeds while Redis is unreachable.
+    """
+    global _acquire_script
+    now = time.time()
+    try:
+        if _acquire_script is None:
+            _acquire_script = get_redis().register_script(_ACQUIRE_SCRIPT)
+        return bool(_acquire_script(keys=[inflight_key(tenant)],
+                                    args=[now, now + INFLIGHT_LEASE, TENANT_MAX_INFLIGHT_RUNS, run_id, INFLIGHT_LEASE]))
+    except Exception as e:
+        logger.warning(f"Fair share accounting unavailable for {tenant}: {str(e)}")
+        return True
+
+def track_run(run_id: str):
+    """
+    Counts a dispatched run in RUNS_INFLIGHT_KEY until it is released, which admission
+    control reads to tell how much work is in progress.
+    """
+    try:
+        get_redis().zadd(RUNS_INFLIGHT_KEY, {run_id: time.time() + INFLIGHT_LEASE})
+    except Exception as e:
+        logger.warning(f"Could not track run {run_id}: {str(e)}")
+
+def release(tenant: Optional[str], run_id: Optional[str]):
+    if not run_id:
+        return
+    try:
+        pipe = get_redis().pipeline()
+        pipe.zrem(RUNS_INFLIGHT_KEY, run_id)
+        if tenant:
+            pipe.zrem(inflight_key(tenant), run_id)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not release run {run_id} of {tenant}: {str(e)}")
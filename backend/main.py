@@ -1,20 +1,41 @@
 # backend/main.py
-from fastapi import FastAPI, WebSocket, HTTPException, Depends, WebSocketDisconnect
+from fastapi import FastAPI, WebSocket, HTTPException, Depends, WebSocketDisconnect, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 from pydantic import BaseModel
 from websocket_manager import manager
-from database import get_db, WorkflowModel
-from sqlalchemy.orm import Session
-from workflow_executor import execute_workflow, get_task_status
+from database import get_async_db, WorkflowModel, WorkflowRunModel, NodeResultModel
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from workflow_executor import execute_workflow, get_task_status, compile_workflow, invalidate_workflow_plan, run_plan
+from batch_status import new_batch_id
+from batches import BATCH_DEFAULT_CONCURRENCY, dispatch_batch, start_batch, run_batch
+from progress import TERMINAL_STATES
+from rate_limiter import get_rate_limit_metrics
+from metrics import render_metrics
+from run_history import build_run_trace, resumable_outputs
+from fair_share import tenant_for
+from admission import ADMISSION_MAX_INFLIGHT_RUNS, ADMISSION_MAX_QUEUED_TASKS, admit_run, get_load
+from prometheus_client import CONTENT_TYPE_LATEST
+from fastapi.concurrency import run_in_threadpool
 import asyncio
+import base64
+import os
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 
 
 app = FastAPI()
 
+# Seconds between status checks that back up the pushed progress events
+STATUS_FALLBACK_INTERVAL = float(os.getenv('STATUS_FALLBACK_INTERVAL', '15'))
+# A socket watching a run that never reports a terminal state (an unknown run id, a
+# chain broken by a killed task) is closed after this many seconds
+WEBSOCKET_MAX_WATCH = float(os.getenv('WEBSOCKET_MAX_WATCH', '3600'))
+WORKFLOW_PAGE_SIZE = 50
+WORKFLOW_MAX_PAGE_SIZE = 200
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -36,45 +57,145 @@ class Edge(BaseModel):
 
 class Workflow(BaseModel):
     blocks: List[Dict[str, Any]]
+    parallel: bool = True
+    use_cache: bool = True
+    incremental: bool = True
+    by_reference: bool = False
+    stream: bool = True
+    # Background runs yield workers to interactive ones
+    bulk: bool = False
+    # Id of the saved workflow these blocks were loaded from, used to reuse unchanged node outputs
+    workflow_id: Optional[int] = None
+
+class WorkflowRunOptions(BaseModel):
+    parallel: bool = True
+    use_cache: bool = True
+    incremental: bool = True
+    by_reference: bool = False
+    stream: bool = True
+    bulk: bool = False
 
 class WorkflowSave(BaseModel):
     name: str
     description: Optional[str]
     workflow: Dict
 
+class WorkflowSummary(BaseModel):
+    id: int
+    name: Optional[str]
+    description: Optional[str]
+    created_at: Optional[datetime]
+
+class WorkflowPage(BaseModel):
+    items: List[WorkflowSummary]
+    # Pass back as `cursor` to get the next page; None on the last page
+    next_cursor: Optional[str]
+
+class WorkflowRunSummary(BaseModel):
+    id: str
+    workflow_id: Optional[int]
+    status: Optional[str]
+    node_count: Optional[int]
+    failed_count: Optional[int]
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
+
+class WorkflowRunPage(BaseModel):
+    items: List[WorkflowRunSummary]
+    next_cursor: Optional[str]
+
+class NodeResult(BaseModel):
+    node_id: str
+    task_type: Optional[str]
+    status: Optional[str]
+    cache: Optional[str]
+    output: Optional[Dict[str, Any]]
+    error: Optional[str]
+    fingerprint: Optional[str]
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
+    duration_ms: Optional[float]
+
+class WorkflowRunDetail(WorkflowRunSummary):
+    nodes: List[NodeResult]
+
+def encode_cursor(created_at: datetime, row_id) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{row_id}".encode()).decode()
+
+def decode_cursor(cursor: str, id_type=int):
+    try:
+        created_at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), id_type(row_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.on_event("startup")
+async def start_progress_listener():
+    await manager.start_listener()
+
+@app.on_event("shutdown")
+async def stop_progress_listener():
+    await manager.stop_listener()
+
+async def wait_for_disconnect(websocket: WebSocket):
+    # The client sends nothing, but reading is what notices that it has gone
+    while (await websocket.receive())['type'] != 'websocket.disconnect':
+        pass
+
 @app.websocket("/ws/{workflow_id}")
 async def websocket_endpoint(websocket: WebSocket, workflow_id: str):
     print(f"WebSocket connection started for workflow: {workflow_id}")
+    viewer = None
+    client_left = None
     try:
-        await manager.connect(websocket, workflow_id)
-        while True:
-            try:
-                status = get_task_status(workflow_id)
-                print(f"Task status for {workflow_id}: {status}")
-                await manager.send_update(workflow_id, status)
-                
-                if status['state'] in ['SUCCESS', 'FAILURE']:
-                    print(f"Workflow {workflow_id} completed with status: {status}")
-                    break
-                    
-                await asyncio.sleep(1)
-            except WebSocketDisconnect:
-                print(f"WebSocket disconnected for workflow: {workflow_id}")
-                await manager.disconnect(websocket, workflow_id)
+        viewer = await manager.connect(websocket, workflow_id)
+        client_left = asyncio.ensure_future(wait_for_disconnect(websocket))
+
+        # Send the current state once; everything after that is pushed by the progress listener
+        status = await run_in_threadpool(get_task_status, workflow_id)
+        viewer.send(status)
+
+        deadline = asyncio.get_running_loop().time() + WEBSOCKET_MAX_WATCH
+        while status['state'] not in TERMINAL_STATES:
+            completion = asyncio.ensure_future(manager.wait_for_completion(viewer, STATUS_FALLBACK_INTERVAL))
+            await asyncio.wait({completion, client_left}, return_when=asyncio.FIRST_COMPLETED)
+            if client_left.done():
+                completion.cancel()
+                raise WebSocketDisconnect()
+            if completion.result():
                 break
-            except Exception as e:
-                print(f"Error in WebSocket loop: {str(e)}")
+            if asyncio.get_running_loop().time() >= deadline:
+                print(f"Workflow {workflow_id} reported no terminal state within {WEBSOCKET_MAX_WATCH}s, closing")
                 break
+            # Safety net for a terminal event that was published while no listener was subscribed
+            status = await run_in_threadpool(get_task_status, workflow_id)
+            if status['state'] in TERMINAL_STATES:
+                viewer.send(status)
+
+        print(f"Workflow {workflow_id} finished or viewer left")
+    except WebSocketDisconnect:
+        print(f"WebSocket disconnected for workflow: {workflow_id}")
     except Exception as e:
         print(f"WebSocket error: {str(e)}")
-        if websocket in manager.active_connections.get(workflow_id, []):
-            await manager.disconnect(websocket, workflow_id)
+    finally:
+        if viewer is not None:
+            await manager.disconnect(viewer)
+            # Close the socket ourselves unless the client is gone or the viewer was dropped
+            if client_left is not None and not client_left.done() and not viewer.closed:
+                try:
+                    await websocket.close()
+                except Exception:
+                    pass
+        if client_left is not None:
+            client_left.cancel()
 
-@app.post("/execute-workflow")
-async def execute_workflow_endpoint(workflow: Workflow):
+@app.post("/execute-workflow", dependencies=[Depends(admit_run)])
+async def execute_workflow_endpoint(workflow: Workflow, x_tenant_id: Optional[str] = Header(None)):
     try:
         workflow_dict = workflow.dict()
-        result = execute_workflow(workflow_dict)
+        workflow_id = workflow_dict.pop('workflow_id')
+        workflow_dict['tenant'] = tenant_for(x_tenant_id, workflow_id)
+        result = await run_in_threadpool(execute_workflow, workflow_dict, workflow_id=workflow_id)
         if result:
             return {"task_id": result.id}
         raise HTTPException(status_code=400, detail="No valid tasks in workflow")
@@ -85,7 +206,7 @@ async def execute_workflow_endpoint(workflow: Workflow):
 @app.get("/task-status/{task_id}")
 async def get_task_status_endpoint(task_id: str):
     try:
-        status = get_task_status(task_id)
+        status = await run_in_threadpool(get_task_status, task_id)
         print(f"Task status for {task_id}: {status}")
         return status
     except Exception as e:
@@ -93,7 +214,7 @@ async def get_task_status_endpoint(task_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/workflows/save")
-async def save_workflow(workflow_data: WorkflowSave, db: Session = Depends(get_db)):
+async def save_workflow(workflow_data: WorkflowSave, db: AsyncSession = Depends(get_async_db)):
     workflow = WorkflowModel(
         name=workflow_data.name,
         description=workflow_data.description,
@@ -101,22 +222,198 @@ async def save_workflow(workflow_data: WorkflowSave, db: Session = Depends(get_d
         created_at=datetime.utcnow()
     )
     db.add(workflow)
-    db.commit()
-    db.refresh(workflow)
+    await db.commit()
+    await db.refresh(workflow)
     return {"id": workflow.id, "message": "Workflow saved successfully"}
 
-@app.get("/workflows")
-async def get_workflows(db: Session = Depends(get_db)):
-    workflows = db.query(WorkflowModel).all()
-    return workflows
+@app.get("/workflows", response_model=WorkflowPage)
+async def get_workflows(limit: int = WORKFLOW_PAGE_SIZE, cursor: Optional[str] = None, search: Optional[str] = None,
+                        db: AsyncSession = Depends(get_async_db)):
+    # Newest first, a page at a time, without loading the workflow definitions
+    limit = max(1, min(limit, WORKFLOW_MAX_PAGE_SIZE))
+    query = select(WorkflowModel.id, WorkflowModel.name, WorkflowModel.description, WorkflowModel.created_at)
+    if search:
+        query = query.where(WorkflowModel.name.ilike(f"%{search}%"))
+    if cursor:
+        created_at, workflow_id = decode_cursor(cursor)
+        query = query.where(or_(
+            WorkflowModel.created_at < created_at,
+            and_(WorkflowModel.created_at == created_at, WorkflowModel.id < workflow_id)
+        ))
+    query = query.order_by(WorkflowModel.created_at.desc(), WorkflowModel.id.desc()).limit(limit + 1)
+    rows = (await db.execute(query)).all()
+
+    items = [WorkflowSummary(id=row.id, name=row.name, description=row.description, created_at=row.created_at)
+             for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor(items[-1].created_at, items[-1].id)
+    return WorkflowPage(items=items, next_cursor=next_cursor)
 
 @app.get("/workflows/{workflow_id}")
-async def get_workflow(workflow_id: int, db: Session = Depends(get_db)):
-    workflow = db.query(WorkflowModel).filter(WorkflowModel.id == workflow_id).first()
+async def get_workflow(workflow_id: int, db: AsyncSession = Depends(get_async_db)):
+    workflow = await db.get(WorkflowModel, workflow_id)
     if not workflow:
         raise HTTPException(status_code=404, detail="Workflow not found")
     return workflow
 
+@app.get("/workflows/{workflow_id}/runs", response_model=WorkflowRunPage)
+async def get_workflow_runs(workflow_id: int, limit: int = WORKFLOW_PAGE_SIZE, cursor: Optional[str] = None,
+                            db: AsyncSession = Depends(get_async_db)):
+    # Run history of a saved workflow, newest first, served from the database alone
+    limit = max(1, min(limit, WORKFLOW_MAX_PAGE_SIZE))
+    query = select(WorkflowRunModel).where(WorkflowRunModel.workflow_id == workflow_id)
+    if cursor:
+        started_at, run_id = decode_cursor(cursor, str)
+        query = query.where(or_(
+            WorkflowRunModel.started_at < started_at,
+            and_(WorkflowRunModel.started_at == started_at, WorkflowRunModel.id < run_id)
+        ))
+    query = query.order_by(WorkflowRunModel.started_at.desc(), WorkflowRunModel.id.desc()).limit(limit + 1)
+    runs = (await db.execute(query)).scalars().all()
+
+    items = [WorkflowRunSummary.model_validate(run, from_attributes=True) for run in runs[:limit]]
+    next_cursor = None
+    if len(runs) > limit and items[-1].started_at is not None:
+        next_cursor = encode_cursor(items[-1].started_at, items[-1].id)
+    return WorkflowRunPage(items=items, next_cursor=next_cursor)
+
+@app.get("/runs/{run_id}", response_model=WorkflowRunDetail)
+async def get_run(run_id: str, db: AsyncSession = Depends(get_async_db)):
+    run = await db.get(WorkflowRunModel, run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    query = select(NodeResultModel).where(NodeResultModel.run_id == run_id).order_by(NodeResultModel.started_at)
+    nodes = (await db.execute(query)).scalars().all()
+    return WorkflowRunDetail(
+        **WorkflowRunSummary.model_validate(run, from_attributes=True).dict(),
+        nodes=[NodeResult.model_validate(node, from_attributes=True) for node in nodes]
+    )
+
+@app.get("/runs/{run_id}/trace")
+async def get_run_trace(run_id: str, db: AsyncSession = Depends(get_async_db)):
+    # Timeline and critical path of a finished run, to see where its time went
+    run = await db.get(WorkflowRunModel, run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    query = select(NodeResultModel).where(NodeResultModel.run_id == run_id)
+    nodes = [NodeResult.model_validate(node, from_attributes=True).dict() for node in (await db.execute(query)).scalars()]
+    blocks = []
+    if run.workflow_id is not None:
+        workflow = await db.get(WorkflowModel, run.workflow_id)
+        blocks = (workflow.workflow_json or {}).get('blocks', []) if workflow else []
+    trace = build_run_trace(run.started_at, nodes, blocks)
+    return dict(trace, run_id=run_id, duration_ms=(run.finished_at - run.started_at).total_seconds() * 1000)
+
+@app.post("/runs/{run_id}/resume", dependencies=[Depends(admit_run)])
+async def resume_run(run_id: str, options: Optional[WorkflowRunOptions] = None,
+                     x_tenant_id: Optional[str] = Header(None), db: AsyncSession = Depends(get_async_db)):
+    """
+    Starts a new run of a finished run's workflow that reuses the outputs of the nodes
+    that succeeded and only runs the failed and skipped nodes. Nodes edited since the
+    run, or below an edited node, run again too (see resumable_outputs).
+    """
+    run = await db.get(WorkflowRunModel, run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    if run.workflow_id is None:
+        raise HTTPException(status_code=400, detail="Only runs of saved workflows can be resumed")
+    workflow = await db.get(WorkflowModel, run.workflow_id)
+    if not workflow:
+        raise HTTPException(status_code=404, detail="Workflow not found")
+
+    query = select(NodeResultModel).where(NodeResultModel.run_id == run_id)
+    nodes = [NodeResult.model_validate(node, from_attributes=True).dict() for node in (await db.execute(query)).scalars()]
+    try:
+        plan = await run_in_threadpool(compile_workflow, (workflow.workflow_json or {}).get('blocks', []))
+        outputs = resumable_outputs(nodes, plan.fingerprints)
+        run_options = dict((options or WorkflowRunOptions()).dict(), tenant=tenant_for(x_tenant_id, workflow.id))
+        result = await run_in_threadpool(run_plan, plan, run_options, workflow.id, resume_outputs=outputs)
+        return {"task_id": result.id, "resumed_from": run_id}
+    except Exception as e:
+        print(f"Error resuming run {run_id}: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.put("/workflows/{workflow_id}")
+async def update_workflow(workflow_id: int, workflow_data: WorkflowSave, db: AsyncSession = Depends(get_async_db)):
+    workflow = await db.get(WorkflowModel, workflow_id)
+    if not workflow:
+        raise HTTPException(status_code=404, detail="Workflow not found")
+    # The old definition's compiled plan won't be requested again
+    await run_in_threadpool(invalidate_workflow_plan, (workflow.workflow_json or {}).get('blocks', []))
+    workflow.name = workflow_data.name
+    workflow.description = workflow_data.description
+    workflow.workflow_json = workflow_data.workflow
+    await db.commit()
+    return {"id": workflow.id, "message": "Workflow updated successfully"}
+
+@app.post("/workflows/{workflow_id}/execute", dependencies=[Depends(admit_run)])
+async def execute_saved_workflow(workflow_id: int, options: Optional[WorkflowRunOptions] = None,
+                                 x_tenant_id: Optional[str] = Header(None), db: AsyncSession = Depends(get_async_db)):
+    workflow = await db.get(WorkflowModel, workflow_id)
+    if not workflow:
+        raise HTTPException(status_code=404, detail="Workflow not found")
+    try:
+        workflow_dict = dict(workflow.workflow_json or {}, **(options or WorkflowRunOptions()).dict())
+        workflow_dict['tenant'] = tenant_for(x_tenant_id, workflow.id)
+        result = await run_in_threadpool(execute_workflow, workflow_dict, workflow_id=workflow.id)
+        return {"task_id": result.id}
+    except Exception as e:
+        print(f"Error executing workflow {workflow_id}: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/workflows/{workflow_id}/batch", dependencies=[Depends(admit_run)])
+async def execute_workflow_batch(workflow_id: int, request: Request, concurrency: int = BATCH_DEFAULT_CONCURRENCY,
+                                 parallel: bool = True, use_cache: bool = True, by_reference: bool = False,
+                                 x_tenant_id: Optional[str] = Header(None), db: AsyncSession = Depends(get_async_db)):
+    """
+    Runs a saved workflow once per line of an NDJSON body. Each line maps node ids to
+    data overrides, e.g. {"generateText-1": {"prompt": "..."}}, and its run starts as
+    soon as the line has been received. Results are streamed back as NDJSON in
+    completion order; the X-Batch-Id header can be passed to /task-status for
+    aggregate progress.
+
+    Batch items run at bulk priority, and no more of them are in flight at once than
+    the tenant (X-Tenant-Id, or the workflow) is allowed.
+    """
+    workflow = await db.get(WorkflowModel, workflow_id)
+    if not workflow:
+        raise HTTPException(status_code=404, detail="Workflow not found")
+    try:
+        plan = await run_in_threadpool(compile_workflow, (workflow.workflow_json or {}).get('blocks', []))
+    except Exception as e:
+        print(f"Error preparing batch for workflow {workflow_id}: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+    batch_id = new_batch_id()
+    await start_batch(batch_id, workflow_id)
+    options = {'parallel': parallel, 'use_cache': use_cache, 'by_reference': by_reference,
+               'bulk': True, 'tenant': tenant_for(x_tenant_id, workflow_id)}
+    # The body has to be read before the response starts, which stops reading requests;
+    # items run while the rest of the body is still arriving
+    items = await dispatch_batch(plan, request.stream(), options, batch_id, concurrency)
+    return StreamingResponse(
+        run_batch(items, batch_id),
+        media_type="application/x-ndjson",
+        headers={"X-Batch-Id": batch_id}
+    )
+
+@app.get("/api/rate-limits")
+def read_rate_limits():
+    # Throughput granted and throttled per model, to tune OPENAI_RATE_LIMITS against the quota
+    return get_rate_limit_metrics()
+
+@app.get("/api/load")
+async def read_load():
+    # What admission control sees, next to the limits it enforces
+    load = await get_load()
+    return dict(load, max_queued_tasks=ADMISSION_MAX_QUEUED_TASKS, max_inflight_runs=ADMISSION_MAX_INFLIGHT_RUNS)
+
+@app.get("/metrics")
+def read_metrics():
+    # Histograms recorded by every API process and worker, aggregated in Redis
+    return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/api/health")
 def read_health():
     return {"status": "healthy"}
\ No newline at end of file
@@ -0,0 +1,165 @@
+# backend/metrics.py
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Tuple
+from celery.signals import before_task_publish, task_prerun, task_postrun
+from prometheus_client import CollectorRegistry, generate_latest
+from prometheus_client.core import HistogramMetricFamily
+from redis_client import get_redis
+
+METRICS_KEY_PREFIX = 'metrics:'
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+# Observations are aggregated in-process and written to Redis by a background thread
+# this often (seconds)
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+HISTOGRAMS = {
+    'workflow_task_duration_seconds': ('Time a worker spent running a workflow task', LATENCY_BUCKETS),
+    'workflow_queue_latency_seconds': ('Time a task waited between being published and starting', LATENCY_BUCKETS),
+    'workflow_provider_latency_seconds': ('Latency of OpenAI calls, by model', LATENCY_BUCKETS),
+    'workflow_blob_upload_seconds': ('Time from the end of speech synthesis until its audio blob is committed', LATENCY_BUCKETS),
+    'workflow_plan_seconds': ('Time spent compiling a workflow and dispatching a run, by stage', LATENCY_BUCKETS),
+    'workflow_admission_wait_seconds': ('Time a run request waited in the submission buffer before being admitted', LATENCY_BUCKETS),
+    'workflow_status_lookup_seconds': ('Time spent reading a run status from the result backend', LATENCY_BUCKETS),
+    'websocket_send_seconds': ('Time spent sending one progress event to one WebSocket', LATENCY_BUCKETS),
+    'workflow_payload_bytes': ('Size of the accumulated results returned by a task', SIZE_BUCKETS),
+}
+
+logger = logging.getLogger(__name__)
+
+# (metric name, labels as JSON) -> [count per bucket..., sum]
+_pending: Dict[Tuple[str, str], list] = {}
+_pending_lock = threading.Lock()
+# Process the flusher thread was started in; a forked worker child starts its own
+_flusher_pid = None
+_task_started: Dict[str, float] = {}
+
+def metric_key(name: str) -> str:
+    return f"{METRICS_KEY_PREFIX}{name}"
+
+def observe(name: str, value: float, **labels):
+    """
+    Records one observation of a histogram. Observations are summed in-process and
+    periodically added to the shared counters in Redis, so every API process and
+    worker contributes to the same histograms. The caller never waits on Redis.
+    """
+    if not METRICS_ENABLED:
+        return
+    if _flusher_pid != os.getpid():
+        _start_flusher()
+    buckets = HISTOGRAMS[name][1]
+    key = (name, json.dumps(labels, sort_keys=True))
+    with _pending_lock:
+        counts = _pending.setdefault(key, [0] * (len(buckets) + 2))
+        # Values above the last bound land in the +Inf bucket
+        counts[bisect_left(buckets, value)] += 1
+        counts[-1] += value
+
+def _start_flusher():
+    global _flusher_pid
+    with _pending_lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    threading.Thread(target=_flush_periodically, name='metrics-flusher', daemon=True).start()
+
+def _flush_periodically():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        flush()
+
+@contextmanager
+def span(name: str, **labels):
+    """
+    Times the enclosed block into the histogram `name`.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+def flush():
+    with _pending_lock:
+        pending = dict(_pending)
+        _pending.clear()
+    if not pending:
+        return
+    try:
+        pipe = get_redis().pipeline()
+        for (name, labels), counts in pending.items():
+            for index, count in enumerate(counts[:-1]):
+                if count:
+                    pipe.hincrby(metric_key(name), f"{labels}|{index}", count)
+            pipe.hincrbyfloat(metric_key(name), f"{labels}|sum", counts[-1])
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not flush metrics: {str(e)}")
+
+atexit.register(flush)
+
+class RedisHistogramCollector:
+    """
+    Exposes the histograms aggregated in Redis in the Prometheus format.
+    """
+    def collect(self):
+        r = get_redis()
+        for name, (documentation, buckets) in HISTOGRAMS.items():
+            series: Dict[str, list] = {}
+            for field, value in r.hgetall(metric_key(name)).items():
+                labels, slot = field.decode().rsplit('|', 1)
+                counts = series.setdefault(labels, [0] * (len(buckets) + 2))
+                if slot == 'sum':
+                    counts[-1] = float(value)
+                else:
+                    counts[int(slot)] = int(value)
+
+            label_names = sorted(json.loads(next(iter(series)))) if series else []
+            family = HistogramMetricFamily(name, documentation, labels=label_names)
+            for labels, counts in series.items():
+                label_values = json.loads(labels)
+                cumulative, total = [], 0
+                for bound, count in zip(list(buckets) + [float('inf')], counts[:-1]):
+                    total += count
+                    cumulative.append((str(bound) if bound != float('inf') else '+Inf', total))
+                family.add_metric([str(label_values.get(label, '')) for label in label_names], cumulative, counts[-1])
+            yield family
+
+def render_metrics() -> bytes:
+    flush()
+    registry = CollectorRegistry()
+    registry.register(RedisHistogramCollector())
+    return generate_latest(registry)
+
+@before_task_publish.connect
+def stamp_published_at(headers=None, **kwargs):
+    # Lets the worker measure how long the task waited in the queue
+    if headers is not None:
+        headers['published_at'] = time.time()
+
+@task_prerun.connect
+def start_task_span(task_id=None, task=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+    published_at = getattr(task.request, 'published_at', None)
+    if published_at:
+        observe('workflow_queue_latency_seconds', max(0.0, time.time() - published_at), task=task.name)
+
+@task_postrun.connect
+def finish_task_span(task_id=None, task=None, retval=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        observe('workflow_task_duration_seconds', time.perf_counter() - started, task=task.name, state=state or '')
+    if METRICS_ENABLED and isinstance(retval, dict):
+        try:
+            observe('workflow_payload_bytes', len(json.dumps(retval)), task=task.name)
+        except (TypeError, ValueError):
+            pass
@@ -0,0 +1,67 @@
+# backend/node_retry.py
+import math
+import os
+import random
+from typing import Any, Dict, Optional
+
+# Default retry policy of provider-backed nodes; a block can set its own with
+# data.retry = {"max_retries": ..., "backoff": ..., "backoff_max": ...}
+NODE_MAX_RETRIES = int(os.getenv('NODE_MAX_RETRIES', '3'))
+NODE_RETRY_BACKOFF = float(os.getenv('NODE_RETRY_BACKOFF', '2'))
+NODE_RETRY_BACKOFF_MAX = float(os.getenv('NODE_RETRY_BACKOFF_MAX', '60'))
+# Ceilings of what a block's own policy may ask for; larger values are clamped
+NODE_RETRY_LIMIT = int(os.getenv('NODE_RETRY_LIMIT', '10'))
+NODE_RETRY_BACKOFF_LIMIT = float(os.getenv('NODE_RETRY_BACKOFF_LIMIT', '300'))
+
+# Errors that say nothing about the request itself: the same call can succeed later.
+# Matched by class name so this module doesn't import the provider SDK.
+TRANSIENT_ERRORS = (
+    'APIConnectionError',  # includes APITimeoutError
+    'InternalServerError',  # any 5xx from the provider
+    'RateLimitError',  # still throttled after rate_limited_call's own retries
+    'RateLimitTimeout',
+    'ServiceRequestError',  # blob storage unreachable
+)
+
+def validate_policy(node_id: str, policy: Any) -> Dict[str, Any]:
+    """
+    Checks a block's retry policy when the workflow is compiled, so a bad value fails
+    the request instead of the node's first retry. Returns the policy with its values
+    converted and clamped to NODE_RETRY_LIMIT and NODE_RETRY_BACKOFF_LIMIT.
+    """
+    if not isinstance(policy, dict):
+        raise ValueError(f"retry of node {node_id} must be an object")
+    unknown = set(policy) - {'max_retries', 'backoff', 'backoff_max'}
+    if unknown:
+        raise ValueError(f"Unknown retry settings of node {node_id}: {sorted(unknown)}")
+
+    validated = {}
+    for name, value in policy.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or value < 0:
+            raise ValueError(f"retry.{name} of node {node_id} must be a non-negative number")
+        if name == 'max_retries':
+            if value != int(value):
+                raise ValueError(f"retry.max_retries of node {node_id} must be a whole number")
+            validated[name] = min(int(value), NODE_RETRY_LIMIT)
+        else:
+            validated[name] = min(float(value), NODE_RETRY_BACKOFF_LIMIT)
+    return validated
+
+def is_transient(error: Exception) -> bool:
+    # A waiter on a shared call (see single_flight) sees the type of the leader's error
+    shared_type = getattr(error, 'error_type', None)
+    if shared_type:
+        return shared_type in TRANSIENT_ERRORS
+    return any(cls.__name__ in TRANSIENT_ERRORS for cls in type(error).__mro__)
+
+def retry_delay(policy: Optional[Dict[str, Any]], retries: int) -> Optional[float]:
+    """
+    Returns how long to wait before retry number `retries` + 1 under `policy`, with
+    jittered exponential backoff, or None once the policy's retries are used up.
+    """
+    policy = policy or {}
+    if retries >= int(policy.get('max_retries', NODE_MAX_RETRIES)):
+        return None
+    backoff = float(policy.get('backoff', NODE_RETRY_BACKOFF))
+    backoff_max = float(policy.get('backoff_max', NODE_RETRY_BACKOFF_MAX))
+    return random.uniform(backoff, max(backoff, min(backoff_max, backoff * 2 ** retries)))
@@ -0,0 +1,88 @@
+# backend/node_snapshots.py
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+from redis_client import get_redis
+
+SNAPSHOT_KEY_PREFIX = 'workflow-snapshots:'
+SNAPSHOT_TTL = int(os.getenv('NODE_SNAPSHOT_TTL', str(7 * 24 * 3600)))
+
+# Signature kwargs that change from run to run without changing a node's output
+RUN_SCOPED_KWARGS = ('run_id', 'use_cache', 'by_reference', 'stream', 'retry_policy')
+
+# Outputs holding signed or provider-hosted URLs record when the URL stops working
+# (expires_at); they are only reused while it has at least this many seconds left
+OUTPUT_MIN_VALIDITY = int(os.getenv('OUTPUT_MIN_VALIDITY', str(10 * 60)))
+URL_OUTPUT_KEYS = ('image_url', 'audio_url')
+
+logger = logging.getLogger(__name__)
+
+def snapshot_key(workflow_id: int) -> str:
+    return f"{SNAPSHOT_KEY_PREFIX}{workflow_id}"
+
+def compute_fingerprint(task_sig, upstream_fingerprints: Dict[str, str]) -> str:
+    """
+    Fingerprints a node from its task, its static arguments and the fingerprints of the
+    nodes feeding it, so a change anywhere upstream changes every fingerprint below it.
+    """
+    kwargs = {k: v for k, v in task_sig.kwargs.items() if k not in RUN_SCOPED_KWARGS}
+    payload = json.dumps({
+        'task': task_sig.task,
+        'kwargs': kwargs,
+        'upstream': upstream_fingerprints
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def load_snapshots(workflow_id: int) -> Dict[str, Dict[str, Any]]:
+    """
+    Returns the stored {'fingerprint', 'output', 'saved_at'} of every node of a saved workflow.
+    """
+    try:
+        raw = get_redis().hgetall(snapshot_key(workflow_id))
+    except Exception as e:
+        logger.warning(f"Could not load node snapshots for workflow {workflow_id}: {str(e)}")
+        return {}
+    return {node_id.decode(): json.loads(value) for node_id, value in raw.items()}
+
+def is_fresh(output: Dict[str, Any]) -> bool:
+    """
+    Checks that the URLs in a node's output still work for at least OUTPUT_MIN_VALIDITY
+    seconds. URLs stored without their expiry are treated as expired.
+    """
+    if 'expires_at' in output:
+        return output['expires_at'] - time.time() > OUTPUT_MIN_VALIDITY
+    return not any(key in output for key in URL_OUTPUT_KEYS)
+
+def is_reusable(snapshot: Optional[Dict[str, Any]], fingerprint: str) -> bool:
+    """
+    Checks that a stored snapshot was produced from the same inputs and is still usable.
+    """
+    if snapshot is None or snapshot.get('fingerprint') != fingerprint:
+        return False
+    output = snapshot.get('output', {})
+    return 'error' not in output and is_fresh(output)
+
+def save_snapshots(workflow_id: int, fingerprints: Dict[str, str], accumulated_results: Dict[str, Any]):
+    """
+    Stores the output and fingerprint of every successful node of a run.
+    """
+    now = time.time()
+    snapshots = {}
+    for node_id, fingerprint in fingerprints.items():
+        output = accumulated_results.get(node_id)
+        if output is None or 'error' in output:
+            continue
+        snapshots[node_id] = json.dumps({'fingerprint': fingerprint, 'output': output, 'saved_at': now})
+
+    if not snapshots:
+        return
+    try:
+        pipe = get_redis().pipeline()
+        pipe.hset(snapshot_key(workflow_id), mapping=snapshots)
+        pipe.expire(snapshot_key(workflow_id), SNAPSHOT_TTL)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not save node snapshots for workflow {workflow_id}: {str(e)}")
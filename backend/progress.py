@@ -0,0 +1,52 @@
+# backend/progress.py
+import json
+import logging
+from typing import Dict, Any, Optional
+from redis_client import get_redis
+
+PROGRESS_CHANNEL_PREFIX = 'workflow-progress:'
+TERMINAL_STATES = ('SUCCESS', 'FAILURE')
+
+logger = logging.getLogger(__name__)
+
+def progress_channel(run_id: str) -> str:
+    """
+    Returns the Redis pub/sub channel that carries the progress events of a run.
+    """
+    return f"{PROGRESS_CHANNEL_PREFIX}{run_id}"
+
+def publish_progress(run_id: Optional[str], event: Dict[str, Any]):
+    """
+    Publishes an event for a run. Publishing is best effort: a Redis error is logged
+    and never fails the task that reports the progress.
+    """
+    if not run_id:
+        return
+    try:
+        get_redis().publish(progress_channel(run_id), json.dumps(event))
+    except Exception as e:
+        logger.warning(f"Could not publish progress for run {run_id}: {str(e)}")
+
+def node_status(result: Dict[str, Any]) -> str:
+    """
+    Returns 'SUCCESS' or 'FAILURE' for a node's output, or 'SKIPPED' for a node that
+    didn't run because a node upstream of it failed.
+    """
+    if result.get('skipped'):
+        return 'SKIPPED'
+    return 'FAILURE' if 'error' in result else 'SUCCESS'
+
+def publish_node_event(run_id: Optional[str], node_id: str, status: str, result: Optional[Dict[str, Any]] = None):
+    """
+    Publishes the status of a single node ('STARTED', 'RETRY', or one of node_status).
+    """
+    event = {'state': 'PROGRESS', 'node_id': node_id, 'status': status}
+    if result is not None:
+        event['result'] = result
+    publish_progress(run_id, event)
+
+def publish_node_delta(run_id: Optional[str], node_id: str, delta: str):
+    """
+    Publishes a piece of streamed output of a node as it is generated.
+    """
+    publish_progress(run_id, {'state': 'PROGRESS', 'node_id': node_id, 'status': 'STREAMING', 'delta': delta})
@@ -0,0 +1,174 @@
+# backend/rate_limiter.py
+import json
+import logging
+import os
+import random
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional
+from redis_client import get_redis
+from metrics import span
+
+if TYPE_CHECKING:
+    from openai import RateLimitError
+
+BUCKET_KEY_PREFIX = 'rate-limit:'
+METRICS_KEY_PREFIX = 'rate-limit-metrics:'
+
+# Requests and tokens per minute granted to each model across all workers. Override with
+# OPENAI_RATE_LIMITS, e.g. '{"gpt-3.5-turbo": {"rpm": 3500, "tpm": 160000}}'.
+DEFAULT_RATE_LIMITS = {
+    'gpt-3.5-turbo': {'rpm': 3500, 'tpm': 90000},
+    'dall-e-3': {'rpm': 7},
+    'tts-1': {'rpm': 50},
+}
+RATE_LIMITS = dict(DEFAULT_RATE_LIMITS, **json.loads(os.getenv('OPENAI_RATE_LIMITS', '{}')))
+
+# Longest a call waits for capacity before it fails instead
+RATE_LIMIT_MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT', '120'))
+# Retries of a call the provider answered with 429 despite the limiter
+RATE_LIMIT_MAX_RETRIES = int(os.getenv('RATE_LIMIT_MAX_RETRIES', '5'))
+RATE_LIMIT_BACKOFF_BASE = float(os.getenv('RATE_LIMIT_BACKOFF_BASE', '1'))
+RATE_LIMIT_BACKOFF_MAX = float(os.getenv('RATE_LIMIT_BACKOFF_MAX', '30'))
+
+logger = logging.getLogger(__name__)
+
+# Takes `cost` from every bucket in KEYS, or from none of them. ARGV holds a
+# (capacity per minute, cost) pair per bucket. Returns 0 once the capacity was
+# taken, otherwise the seconds until the emptiest bucket has refilled enough.
+_TAKE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local wait = 0
+local levels = {}
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2 - 1])
+    local cost = math.min(tonumber(ARGV[i * 2]), capacity)
+    local rate = capacity / 60
+    local bucket = redis.call('HMGET', key, 'level', 'updated_at')
+    local level = tonumber(bucket[1]) or capacity
+    local updated_at = tonumber(bucket[2]) or now
+    level = math.min(capacity, level + math.max(0, now - updated_at) * rate)
+    levels[i] = level - cost
+    if level < cost then
+        wait = math.max(wait, (cost - level) / rate)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    redis.call('HSET', key, 'level', levels[i], 'updated_at', now)
+    redis.call('EXPIRE', key, 120)
+end
+return '0'
+"""
+
+_take_script = None
+
+class RateLimitTimeout(Exception):
+    pass
+
+def bucket_key(model: str, limit: str) -> str:
+    return f"{BUCKET_KEY_PREFIX}{model}:{limit}"
+
+def metrics_key(model: str) -> str:
+    return f"{METRICS_KEY_PREFIX}{model}"
+
+def estimate_tokens(text: str, max_output_tokens: int = 500) -> int:
+    """
+    Rough token count of a chat call, about four characters per prompt token plus the reply.
+    """
+    return len(text) // 4 + max_output_tokens
+
+def _record(model: str, **counters):
+    try:
+        pipe = get_redis().pipeline()
+        for name, amount in counters.items():
+            pipe.hincrbyfloat(metrics_key(model), name, amount)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not record rate limit metrics for {model}: {str(e)}")
+
+def acquire(model: str, tokens: int = 0):
+    """
+    Blocks until the shared buckets of the model have room for one request using
+    `tokens` tokens. Models without configured limits pass straight through, and so
+    does every call while Redis is unreachable.
+    """
+    global _take_script
+    limits = RATE_LIMITS.get(model)
+    if not limits:
+        return
+
+    keys, args = [], []
+    if limits.get('rpm'):
+        keys.append(bucket_key(model, 'requests'))
+        args += [limits['rpm'], 1]
+    if limits.get('tpm') and tokens:
+        keys.append(bucket_key(model, 'tokens'))
+        args += [limits['tpm'], tokens]
+
+    started = time.monotonic()
+    throttled = False
+    while True:
+        try:
+            if _take_script is None:
+                _take_script = get_redis().register_script(_TAKE_SCRIPT)
+            wait = float(_take_script(keys=keys, args=args))
+        except Exception as e:
+            logger.warning(f"Rate limiter unavailable for {model}, calling without it: {str(e)}")
+            return
+        if wait == 0:
+            break
+        waited = time.monotonic() - started
+        if waited + wait > RATE_LIMIT_MAX_WAIT:
+            _record(model, throttled_seconds=waited, timeouts=1)
+            raise RateLimitTimeout(f"No {model} capacity within {RATE_LIMIT_MAX_WAIT:.0f}s")
+        # A little jitter keeps waiting workers from retrying in lockstep
+        time.sleep(wait + random.uniform(0, 0.1))
+        throttled = True
+
+    if throttled:
+        _record(model, requests=1, tokens=tokens, throttled_requests=1, throttled_seconds=time.monotonic() - started)
+    else:
+        _record(model, requests=1, tokens=tokens)
+
+def _retry_after(error: 'RateLimitError') -> Optional[float]:
+    try:
+        return float(error.response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def rate_limited_call(model: str, call: Callable[[], Any], tokens: int = 0) -> Any:
+    """
+    Runs a provider call once the model has capacity. A 429 from the provider is
+    retried with jittered exponential backoff, honouring its Retry-After header.
+    """
+    # Imported here so the API, which only reads the metrics, doesn't load the SDK
+    from openai import RateLimitError
+    for attempt in range(RATE_LIMIT_MAX_RETRIES + 1):
+        acquire(model, tokens)
+        try:
+            with span('workflow_provider_latency_seconds', model=model):
+                return call()
+        except RateLimitError as e:
+            _record(model, provider_429s=1)
+            if attempt == RATE_LIMIT_MAX_RETRIES:
+                raise
+            backoff = random.uniform(0, min(RATE_LIMIT_BACKOFF_MAX, RATE_LIMIT_BACKOFF_BASE * 2 ** attempt))
+            delay = max(backoff, _retry_after(e) or 0)
+            logger.warning(f"{model} returned 429, retrying in {delay:.1f}s (attempt {attempt + 1})")
+            _record(model, throttled_seconds=delay)
+            time.sleep(delay)
+
+def get_rate_limit_metrics() -> Dict[str, Dict[str, Any]]:
+    """
+    Returns the configured limits and throttling counters of every model: requests and
+    tokens granted, requests that had to wait, seconds spent waiting, timeouts and 429s.
+    """
+    r = get_redis()
+    metrics = {}
+    for model, limits in RATE_LIMITS.items():
+        counters = {name.decode(): float(value) for name, value in r.hgetall(metrics_key(model)).items()}
+        metrics[model] = {'limits': limits, **counters}
+    return metrics
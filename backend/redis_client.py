@@ -0,0 +1,27 @@
+# backend/redis_client.py
+import os
+import redis
+import redis.asyncio as aioredis
+
+REDIS_URL = os.getenv('REDIS_URL')
+
+_redis = None
+_async_redis = None
+
+def get_redis() -> redis.Redis:
+    """
+    Returns the process-wide synchronous Redis client, creating it on first use.
+    """
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(REDIS_URL)
+    return _redis
+
+def get_async_redis() -> aioredis.Redis:
+    """
+    Returns the process-wide asyncio Redis client used by the API, creating it on first use.
+    """
+    global _async_redis
+    if _async_redis is None:
+        _async_redis = aioredis.Redis.from_url(REDIS_URL)
+    return _async_redis
@@ -0,0 +1,108 @@
+# backend/result_cache.py
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+from redis_client import get_redis
+from single_flight import single_flight
+
+CACHE_KEY_PREFIX = 'result-cache:'
+# Sorted set of cache keys scored by their last access time, used for LRU eviction
+CACHE_INDEX_KEY = 'result-cache-index'
+# Sorted set of the same keys scored by the time they expire, which depends on the
+# TTL each entry was stored with
+CACHE_EXPIRY_KEY = 'result-cache-expiry'
+CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', '86400'))
+CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', '10000'))
+
+logger = logging.getLogger(__name__)
+
+def make_cache_key(task_type: str, model: str, prompt: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Builds a content-addressed cache key from everything that determines a provider result.
+    """
+    payload = json.dumps({
+        'task': task_type,
+        'model': model,
+        'prompt': prompt,
+        'params': params or {}
+    }, sort_keys=True)
+    return CACHE_KEY_PREFIX + hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def get_cached(key: str) -> Optional[Any]:
+    """
+    Returns the cached value for a key, or None on a miss. A hit refreshes the key's LRU position.
+    """
+    r = get_redis()
+    raw = r.get(key)
+    if raw is None:
+        return None
+    r.zadd(CACHE_INDEX_KEY, {key: time.time()})
+    return json.loads(raw)
+
+def set_cached(key: str, value: Any, ttl: int = CACHE_TTL):
+    """
+    Stores a value and evicts the least recently used entries once the cache is over its size bound.
+    """
+    r = get_redis()
+    now = time.time()
+    pipe = r.pipeline()
+    pipe.set(key, json.dumps(value), ex=ttl)
+    pipe.zadd(CACHE_INDEX_KEY, {key: now})
+    pipe.zadd(CACHE_EXPIRY_KEY, {key: now + ttl})
+    # Entries that have expired on their own no longer count towards the size bound
+    pipe.zrangebyscore(CACHE_EXPIRY_KEY, '-inf', now)
+    pipe.zremrangebyscore(CACHE_EXPIRY_KEY, '-inf', now)
+    # No TTL is longer than CACHE_TTL, so this also drops entries indexed before
+    # CACHE_EXPIRY_KEY existed
+    pipe.zremrangebyscore(CACHE_INDEX_KEY, 0, now - CACHE_TTL)
+    pipe.zcard(CACHE_INDEX_KEY)
+    expired, _, _, size = pipe.execute()[-4:]
+    if expired:
+        size -= r.zrem(CACHE_INDEX_KEY, *expired)
+
+    if size > CACHE_MAX_ENTRIES:
+        evicted = [member for member, _ in r.zpopmin(CACHE_INDEX_KEY, size - CACHE_MAX_ENTRIES)]
+        if evicted:
+            pipe = r.pipeline()
+            pipe.delete(*evicted)
+            pipe.zrem(CACHE_EXPIRY_KEY, *evicted)
+            pipe.execute()
+
+def cached_call(task_type: str, model: str, prompt: str, params: Optional[Dict[str, Any]],
+                compute: Callable[[], Any], use_cache: bool = True, ttl: int = CACHE_TTL) -> Tuple[Any, str]:
+    """
+    Returns the result of compute() through the cache, together with the cache status
+    ('hit', 'miss', 'bypass' or 'shared'). Cache errors are logged and fall back to
+    computing the result.
+
+    Identical cached calls that are in flight at the same time are coalesced: only one
+    of them runs compute() and the others get its result with the status 'shared'.
+    With use_cache set to False every call runs compute() itself, since the caller
+    asked for a fresh result.
+    """
+    if not use_cache:
+        return compute(), 'bypass'
+
+    key = make_cache_key(task_type, model, prompt, params)
+
+    try:
+        value = get_cached(key)
+        if value is not None:
+            logger.info(f"Result cache hit for {task_type}")
+            return value, 'hit'
+    except Exception as e:
+        logger.warning(f"Result cache lookup failed: {str(e)}")
+
+    def compute_and_store():
+        value = compute()
+        try:
+            set_cached(key, value, ttl)
+        except Exception as e:
+            logger.warning(f"Result cache store failed: {str(e)}")
+        return value
+
+    value, shared = single_flight(key, compute_and_store)
+    return value, 'shared' if shared else 'miss'
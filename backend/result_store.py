@@ -0,0 +1,57 @@
+# backend/result_store.py
+import json
+import os
+from collections import defaultdict
+from typing import Any, Dict
+from redis_client import get_redis
+
+RESULT_KEY_PREFIX = 'run-results:'
+RESULT_TTL = int(os.getenv('RUN_RESULT_TTL', str(24 * 3600)))
+REF_KEY = '$ref'
+
+def result_key(run_id: str) -> str:
+    return f"{RESULT_KEY_PREFIX}{run_id}"
+
+def make_ref(run_id: str) -> Dict[str, str]:
+    """
+    Returns the placeholder passed down the chain instead of a node's output.
+    """
+    return {REF_KEY: run_id}
+
+def is_ref(value: Any) -> bool:
+    return isinstance(value, dict) and REF_KEY in value
+
+def store_outputs(run_id: str, outputs: Dict[str, Dict[str, Any]]):
+    """
+    Writes node outputs once to the run's result hash.
+    """
+    pipe = get_redis().pipeline()
+    pipe.hset(result_key(run_id), mapping={node_id: json.dumps(output) for node_id, output in outputs.items()})
+    pipe.expire(result_key(run_id), RESULT_TTL)
+    pipe.execute()
+
+def load_output(ref: Dict[str, str], node_id: str) -> Dict[str, Any]:
+    """
+    Fetches a single node output named by a reference.
+    """
+    raw = get_redis().hget(result_key(ref[REF_KEY]), node_id)
+    return json.loads(raw) if raw is not None else {}
+
+def resolve_results(accumulated_results: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Replaces every reference in accumulated_results with the stored output,
+    fetching all outputs of a run in one round trip.
+    """
+    refs_by_run = defaultdict(list)
+    for node_id, value in accumulated_results.items():
+        if is_ref(value):
+            refs_by_run[value[REF_KEY]].append(node_id)
+    if not refs_by_run:
+        return accumulated_results
+
+    resolved = dict(accumulated_results)
+    for run_id, node_ids in refs_by_run.items():
+        values = get_redis().hmget(result_key(run_id), node_ids)
+        for node_id, raw in zip(node_ids, values):
+            resolved[node_id] = json.loads(raw) if raw is not None else {}
+    return resolved
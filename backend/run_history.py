@@ -0,0 +1,165 @@
+# backend/run_history.py
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from sqlalchemy import insert
+from redis_client import get_redis
+from progress import node_status
+from node_snapshots import is_fresh
+
+HISTORY_KEY_PREFIX = 'run-history:'
+# Node records of a run that never finishes are dropped after this long
+HISTORY_BUFFER_TTL = int(os.getenv('RUN_HISTORY_BUFFER_TTL', str(24 * 3600)))
+RECORD_RUN_HISTORY = os.getenv('RECORD_RUN_HISTORY', 'true').lower() == 'true'
+
+logger = logging.getLogger(__name__)
+
+def history_key(run_id: str) -> str:
+    return f"{HISTORY_KEY_PREFIX}{run_id}"
+
+def record_node(run_id: Optional[str], node_id: str, node_type: str, started_at: float, result: Dict[str, Any]):
+    """
+    Buffers the timing and status of a finished node in Redis. Nothing is written to the
+    database until the run finishes, so nodes never wait on an INSERT.
+    """
+    if not run_id or not RECORD_RUN_HISTORY:
+        return
+    record = {
+        'node_id': node_id,
+        'task_type': node_type,
+        'status': node_status(result),
+        'cache': result.get('cache'),
+        'started_at': started_at,
+        'finished_at': time.time()
+    }
+    try:
+        pipe = get_redis().pipeline()
+        pipe.rpush(history_key(run_id), json.dumps(record))
+        pipe.expire(history_key(run_id), HISTORY_BUFFER_TTL)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not record node {node_id} of run {run_id}: {str(e)}")
+
+def _timestamp(value: Optional[float]) -> Optional[datetime]:
+    return datetime.utcfromtimestamp(value) if value is not None else None
+
+def flush_run(run_id: Optional[str], workflow_id: Optional[int], accumulated_results: Dict[str, Any],
+              fingerprints: Optional[Dict[str, str]] = None):
+    """
+    Writes a finished run and the records of all its nodes in one transaction, with a
+    single bulk INSERT for the nodes. Nodes whose outputs were reused from an earlier
+    run have no record and are stored with the status 'REUSED'. fingerprints are the
+    node fingerprints of the plan the run was started from, if any.
+    """
+    if not run_id or not RECORD_RUN_HISTORY:
+        return
+    try:
+        pipe = get_redis().pipeline()
+        pipe.lrange(history_key(run_id), 0, -1)
+        pipe.delete(history_key(run_id))
+        records = {record['node_id']: record for record in map(json.loads, pipe.execute()[0])}
+    except Exception as e:
+        logger.warning(f"Could not read the node records of run {run_id}: {str(e)}")
+        records = {}
+
+    rows = []
+    for node_id, output in accumulated_results.items():
+        record = records.get(node_id, {'status': 'REUSED'})
+        started_at, finished_at = record.get('started_at'), record.get('finished_at')
+        rows.append({
+            'run_id': run_id,
+            'node_id': node_id,
+            'task_type': record.get('task_type'),
+            'status': record['status'],
+            'cache': record.get('cache'),
+            'output': None if 'error' in output else output,
+            'error': output.get('error'),
+            'fingerprint': (fingerprints or {}).get(node_id),
+            'started_at': _timestamp(started_at),
+            'finished_at': _timestamp(finished_at),
+            'duration_ms': (finished_at - started_at) * 1000 if started_at is not None else None
+        })
+
+    started = [record['started_at'] for record in records.values()]
+    failed_count = sum(1 for row in rows if row['status'] == 'FAILURE')
+    run = {
+        'id': run_id,
+        'workflow_id': workflow_id,
+        'status': 'FAILURE' if failed_count else 'SUCCESS',
+        'node_count': len(rows),
+        'failed_count': failed_count,
+        'started_at': _timestamp(min(started)) if started else datetime.utcnow(),
+        'finished_at': datetime.utcnow()
+    }
+
+    try:
+        # Imported here so workers without DATABASE_URL can still run workflows
+        from database import SessionLocal, WorkflowRunModel, NodeResultModel
+        with SessionLocal() as db:
+            db.execute(insert(WorkflowRunModel), [run])
+            if rows:
+                db.execute(insert(NodeResultModel), rows)
+            db.commit()
+    except Exception as e:
+        logger.warning(f"Could not store the history of run {run_id}: {str(e)}")
+
+def resumable_outputs(nodes: List[Dict[str, Any]], fingerprints: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Picks the outputs of a recorded run that a resumed run can start from: those of
+    the nodes that succeeded or were reused, whose fingerprint matches the current
+    plan's (so neither the node nor anything upstream of it was edited since) and
+    whose URLs haven't expired (see is_fresh). Every other node runs again.
+    """
+    outputs = {}
+    for node in nodes:
+        if node['status'] not in ('SUCCESS', 'REUSED') or node['output'] is None:
+            continue
+        if node['fingerprint'] is None or node['fingerprint'] != fingerprints.get(node['node_id']):
+            continue
+        if not is_fresh(node['output']):
+            continue
+        outputs[node['node_id']] = node['output']
+    return outputs
+
+def build_run_trace(run_started_at: datetime, nodes: List[Dict[str, Any]], blocks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Lays the recorded nodes of a run out on a timeline and finds its critical path:
+    starting from the node that finished last, repeatedly step to the input that
+    finished last, i.e. the one the node was waiting for. The wait before each node
+    on the path (queueing and hand-over between tasks) is reported alongside it.
+    Without the workflow's blocks the inputs are unknown and no path is computed.
+    """
+    def offset_ms(moment: Optional[datetime]) -> Optional[float]:
+        return (moment - run_started_at).total_seconds() * 1000 if moment is not None else None
+
+    timed = {node['node_id']: node for node in nodes if node['started_at'] is not None}
+    timeline = sorted(({
+        'node_id': node['node_id'],
+        'task_type': node['task_type'],
+        'status': node['status'],
+        'start_ms': offset_ms(node['started_at']),
+        'end_ms': offset_ms(node['finished_at']),
+        'duration_ms': node['duration_ms']
+    } for node in timed.values()), key=lambda span: span['start_ms'])
+
+    critical_path = None
+    if blocks and timed:
+        inputs = {block['id']: list(block.get('inputs', {}).values()) for block in blocks}
+        node_id = max(timed, key=lambda candidate: timed[candidate]['finished_at'])
+        critical_path = []
+        while node_id is not None:
+            upstream = [source for source in inputs.get(node_id, []) if source in timed]
+            waited_for = max(upstream, key=lambda source: timed[source]['finished_at']) if upstream else None
+            ready_at = timed[waited_for]['finished_at'] if waited_for else run_started_at
+            critical_path.append({
+                'node_id': node_id,
+                'duration_ms': timed[node_id]['duration_ms'],
+                'wait_ms': max(0.0, (timed[node_id]['started_at'] - ready_at).total_seconds() * 1000)
+            })
+            node_id = waited_for
+        critical_path.reverse()
+
+    return {'nodes': timeline, 'critical_path': critical_path}
@@ -0,0 +1,116 @@
+# backend/single_flight.py
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Any, Callable, Optional, Tuple
+from redis_client import get_redis
+
+FLIGHT_KEY_PREFIX = 'single-flight:'
+SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', 'true').lower() == 'true'
+# Longest a call may hold its flight; waiters give up on a leader that vanished after this
+SINGLE_FLIGHT_LEASE = int(os.getenv('SINGLE_FLIGHT_LEASE', '300'))
+# A finished flight's result is only kept long enough for its waiters to pick it up
+SINGLE_FLIGHT_RESULT_TTL = int(os.getenv('SINGLE_FLIGHT_RESULT_TTL', '30'))
+SINGLE_FLIGHT_POLL_INTERVAL = float(os.getenv('SINGLE_FLIGHT_POLL_INTERVAL', '0.05'))
+SINGLE_FLIGHT_MAX_POLL_INTERVAL = float(os.getenv('SINGLE_FLIGHT_MAX_POLL_INTERVAL', '0.5'))
+
+logger = logging.getLogger(__name__)
+
+# Deletes the flight only if it is still the caller's, so a leader that overran its
+# lease can't end the flight of the call that took over
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_release_script = None
+
+class SharedCallError(Exception):
+    """
+    Raised in the callers that waited on a flight whose call failed. error_type names
+    the class of the leader's error.
+    """
+    def __init__(self, message: str, error_type: Optional[str] = None):
+        super().__init__(message)
+        self.error_type = error_type
+
+def flight_key(key: str) -> str:
+    return f"{FLIGHT_KEY_PREFIX}{key}"
+
+def result_key(key: str, token: str) -> str:
+    return f"{FLIGHT_KEY_PREFIX}{key}:{token}"
+
+def _finish(r, key: str, token: str, outcome: dict):
+    global _release_script
+    if _release_script is None:
+        _release_script = r.register_script(_RELEASE_SCRIPT)
+    r.set(result_key(key, token), json.dumps(outcome), ex=SINGLE_FLIGHT_RESULT_TTL)
+    _release_script(keys=[flight_key(key)], args=[token])
+
+def _wait(r, key: str, token: str):
+    """
+    Waits for the flight `token` to publish its result. Returns the outcome, or None
+    once the flight is gone without one (its leader died) and the caller should retry.
+    """
+    interval = SINGLE_FLIGHT_POLL_INTERVAL
+    while True:
+        # The result is written before the flight ends, so one read of both suffices
+        raw, current = r.mget(result_key(key, token), flight_key(key))
+        if raw is not None:
+            return json.loads(raw)
+        if current is None or current.decode() != token:
+            return None
+        time.sleep(interval)
+        interval = min(interval * 2, SINGLE_FLIGHT_MAX_POLL_INTERVAL)
+
+def single_flight(key: str, compute: Callable[[], Any]) -> Tuple[Any, bool]:
+    """
+    Runs compute() once for all concurrent callers of the same key, across workers.
+    The first caller takes the flight and runs the call; the others wait for it and
+    get its result (or its error, as SharedCallError). Results are only shared with
+    calls that overlapped the flight: a caller arriving after it ended runs its own.
+
+    Returns the value and whether it was shared from another caller's flight. When
+    Redis is unreachable every caller simply runs compute() itself.
+    """
+    if not SINGLE_FLIGHT_ENABLED:
+        return compute(), False
+
+    token = uuid.uuid4().hex
+    while True:
+        try:
+            r = get_redis()
+            if r.set(flight_key(key), token, nx=True, ex=SINGLE_FLIGHT_LEASE):
+                break
+            leader = r.get(flight_key(key))
+            if leader is None:
+                continue
+            outcome = _wait(r, key, leader.decode())
+        except Exception as e:
+            logger.warning(f"Single flight unavailable, calling directly: {str(e)}")
+            return compute(), False
+        if outcome is None:
+            continue
+        if 'error' in outcome:
+            raise SharedCallError(outcome['error'], outcome.get('type'))
+        logger.info(f"Shared the result of an identical in-flight call for {key}")
+        return outcome['value'], True
+
+    outcome = {'error': 'The shared call was interrupted'}
+    try:
+        value = compute()
+    except Exception as e:
+        outcome = {'error': str(e), 'type': type(e).__name__}
+        raise
+    else:
+        outcome = {'value': value}
+        return value, False
+    finally:
+        try:
+            _finish(r, key, token, outcome)
+        except Exception as e:
+            logger.warning(f"Could not publish the result of flight {key}: {str(e)}")
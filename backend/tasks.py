@@ -1,131 +1,329 @@
 from celery_app import celery_app
-from openai import OpenAI
+import httpx
+from openai import DefaultHttpxClient, OpenAI
 import os
 import logging
-from io import BytesIO
-from azure_storage import upload_audio_to_blob, generate_blob_sas_url
+import threading
+import time
+from azure_storage import stream_audio_to_blob, generate_blob_sas_url
+from progress import node_status, publish_node_event, publish_node_delta, publish_progress
+from result_cache import cached_call
+from rate_limiter import estimate_tokens, rate_limited_call
+from node_snapshots import save_snapshots
+from result_store import is_ref, load_output, make_ref, resolve_results, store_outputs
+from run_history import record_node, flush_run
+from fair_share import release
+from node_retry import is_transient, retry_delay
+# Registers the task signal handlers that time every task
+import metrics
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-key = os.environ['OPENAI_API_KEY']
+# Created on first use by get_openai_client, so importing tasks needs no API key
+client = None
+_client_lock = threading.Lock()
 
-client = OpenAI(api_key=key)
+# Every task a worker process runs shares one keep-alive connection pool to OpenAI. Under
+# the gevent pool dozens of calls are in flight at once; over HTTP/2 they share connections.
+OPENAI_HTTP2 = os.getenv('OPENAI_HTTP2', 'true').lower() == 'true'
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', '100'))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('OPENAI_MAX_KEEPALIVE_CONNECTIONS', '20'))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv('OPENAI_KEEPALIVE_EXPIRY', '30'))
 
-@celery_app.task(name='tasks.generate_text')
-def generate_text(accumulated_results, node_id, prompt=''):
+# DALL-E image URLs expire after an hour, so cached URLs must expire before they do
+IMAGE_URL_LIFETIME = 60 * 60
+IMAGE_CACHE_TTL = 50 * 60
+# Streamed tokens are forwarded at most this often (seconds) to keep pub/sub traffic low
+STREAM_FLUSH_INTERVAL = float(os.getenv('STREAM_FLUSH_INTERVAL', '0.05'))
+# Bytes read from the speech response at a time while it is piped into blob storage
+TTS_CHUNK_SIZE = int(os.getenv('TTS_CHUNK_SIZE', str(64 * 1024)))
+
+def get_openai_client() -> OpenAI:
+    """
+    Returns the worker process's OpenAI client, creating it on first use.
+    """
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                limits = httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS,
+                                      max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                                      keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY)
+                client = OpenAI(api_key=os.environ['OPENAI_API_KEY'],
+                                http_client=DefaultHttpxClient(http2=OPENAI_HTTP2, limits=limits))
+    return client
+
+def _get_input(accumulated_results, node_id):
+    # Inputs passed by reference are fetched from the run's result store on demand
+    result = accumulated_results.get(node_id, {})
+    if is_ref(result):
+        return load_output(result, node_id)
+    return result
+
+def _stream_completion(run_id, node_id, **params):
+    # Forward token deltas to the run's viewers as they arrive and return the assembled text
+    parts = []
+    pending = []
+    last_flush = time.monotonic()
+    for chunk in get_openai_client().chat.completions.create(stream=True, **params):
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            continue
+        parts.append(chunk.choices[0].delta.content)
+        pending.append(chunk.choices[0].delta.content)
+        if time.monotonic() - last_flush >= STREAM_FLUSH_INTERVAL:
+            publish_node_delta(run_id, node_id, ''.join(pending))
+            pending = []
+            last_flush = time.monotonic()
+    if pending:
+        publish_node_delta(run_id, node_id, ''.join(pending))
+    return ''.join(parts)
+
+def _display_text_output(previous_result):
+    text = previous_result.get('text', '')
+    return {'displayedText': text, 'text': text}
+
+def _display_image_output(previous_result):
+    output = {'image_url': previous_result.get('image_url', '')}
+    if 'expires_at' in previous_result:
+        output['expires_at'] = previous_result['expires_at']
+    return output
+
+# Nodes that only reshape their input; the executor fuses them into the task producing that input
+LIGHT_NODE_OUTPUTS = {
+    'displayText': _display_text_output,
+    'displayImage': _display_image_output
+}
+
+def _upstream_failure(previous_result, previous_node_id):
+    # A node whose input failed is skipped instead of spending a provider call on the error
+    if 'error' not in previous_result:
+        return None
+    failed_node = previous_result.get('failed_node', previous_node_id)
+    return {'error': f"Skipped because node {failed_node} failed", 'skipped': True, 'failed_node': failed_node}
+
+def _retry_if_transient(task, error, node_id, run_id, retry_policy=None):
+    """
+    Re-queues just this node after a backoff when its provider error is transient;
+    the rest of the run waits for it. Returns once the node has failed for good.
+    """
+    if task.request.called_directly or not is_transient(error):
+        return
+    retries = task.request.retries
+    delay = retry_delay(retry_policy, retries)
+    if delay is None:
+        return
+    logger.warning(f"Node {node_id} failed with {type(error).__name__}, retrying in {delay:.1f}s (retry {retries + 1})")
+    publish_node_event(run_id, node_id, 'RETRY', {'error': str(error), 'retries': retries + 1})
+    # Retries are counted by retry_delay against the node's own policy
+    raise task.retry(exc=error, countdown=delay, max_retries=None)
+
+def _publish_result(accumulated_results, node_id, run_id):
+    # Push the node's outcome to everyone watching the run
+    result = accumulated_results[node_id]
+    publish_node_event(run_id, node_id, node_status(result), result)
+
+def _node_started(run_id, node_id):
+    publish_node_event(run_id, node_id, 'STARTED')
+    return time.time()
+
+def _node_finished(accumulated_results, node_id, node_type, started_at, run_id, by_reference=False, fused_nodes=None):
+    _publish_result(accumulated_results, node_id, run_id)
+    record_node(run_id, node_id, node_type, started_at, accumulated_results[node_id])
+    finished = [node_id]
+
+    # Lightweight nodes fused into this task run here instead of costing a broker round trip each
+    for fused in fused_nodes or []:
+        fused_started_at = _node_started(run_id, fused['node_id'])
+        try:
+            previous_result = _get_input(accumulated_results, fused['previous_node_id'])
+            accumulated_results[fused['node_id']] = (_upstream_failure(previous_result, fused['previous_node_id'])
+                                                     or LIGHT_NODE_OUTPUTS[fused['type']](previous_result))
+        except Exception as e:
+            logger.error(f"Error in fused node {fused['node_id']}: {str(e)}")
+            accumulated_results[fused['node_id']] = {'error': str(e)}
+        _publish_result(accumulated_results, fused['node_id'], run_id)
+        record_node(run_id, fused['node_id'], fused['type'], fused_started_at, accumulated_results[fused['node_id']])
+        finished.append(fused['node_id'])
+
+    if by_reference and run_id:
+        try:
+            store_outputs(run_id, {finished_id: accumulated_results[finished_id] for finished_id in finished})
+            for finished_id in finished:
+                accumulated_results[finished_id] = make_ref(run_id)
+        except Exception as e:
+            logger.warning(f"Could not store results of node {node_id}, passing them inline: {str(e)}")
+    return accumulated_results
+
+@celery_app.task(name='tasks.generate_text', bind=True)
+def generate_text(self, accumulated_results, node_id, prompt='', run_id=None, use_cache=True, by_reference=False, stream=False,
+                  fused_nodes=None, retry_policy=None):
+    started_at = _node_started(run_id, node_id)
     print(f"Generate text task started with prompt: {prompt}")
     try:
-        response = client.chat.completions.create(model="gpt-3.5-turbo",
-        messages=[{"role": "user", "content": prompt}])
-        text = response.choices[0].message.content
-        accumulated_results[node_id] = {'text': text}
+        def request_completion():
+            if stream and run_id:
+                return _stream_completion(run_id, node_id, model="gpt-3.5-turbo",
+                messages=[{"role": "user", "content": prompt}])
+            response = get_openai_client().chat.completions.create(model="gpt-3.5-turbo",
+            messages=[{"role": "user", "content": prompt}])
+            return response.choices[0].message.content
+
+        def create_completion():
+            return rate_limited_call('gpt-3.5-turbo', request_completion, estimate_tokens(prompt))
+
+        text, cache_status = cached_call('generate_text', 'gpt-3.5-turbo', prompt, None, create_completion, use_cache)
+        accumulated_results[node_id] = {'text': text, 'cache': cache_status}
         print(f"Generate text task completed with result: {text}")
-        return accumulated_results
+        return _node_finished(accumulated_results, node_id, 'generateText', started_at, run_id, by_reference, fused_nodes)
     except Exception as e:
+        _retry_if_transient(self, e, node_id, run_id, retry_policy)
         print(f"Error in generate_text: {str(e)}")
         accumulated_results[node_id] = {'error': str(e)}
-        return accumulated_results
+        return _node_finished(accumulated_results, node_id, 'generateText', started_at, run_id, by_reference, fused_nodes)
 
 @celery_app.task(name='tasks.display_text')
-def display_text(accumulated_results, node_id, previous_node_id):
+def display_text(accumulated_results, node_id, previous_node_id, run_id=None, by_reference=False):
+    started_at = _node_started(run_id, node_id)
     print(f"Display text task started")
     try:
-        previous_result = accumulated_results.get(previous_node_id, {})
-        if 'error' in previous_result:
-            accumulated_results[node_id] = previous_result
-        else:
-            text = previous_result.get('text', '')
-            accumulated_results[node_id] = {'displayedText': text, 'text': text}
+        previous_result = _get_input(accumulated_results, previous_node_id)
+        accumulated_results[node_id] = _upstream_failure(previous_result, previous_node_id) or _display_text_output(previous_result)
         print(f"Display text task completed with result: {accumulated_results[node_id]}")
-        return accumulated_results
+        return _node_finished(accumulated_results, node_id, 'displayText', started_at, run_id, by_reference)
     except Exception as e:
         print(f"Error in display_text: {str(e)}")
         accumulated_results[node_id] = {'error': str(e)}
-        return accumulated_results
+        return _node_finished(accumulated_results, node_id, 'displayText', started_at, run_id, by_reference)
 
-@celery_app.task(name='tasks.generate_image')
-def generate_image(accumulated_results, node_id, prompt='', previous_node_id=None):
+@celery_app.task(name='tasks.generate_image', bind=True)
+def generate_image(self, accumulated_results, node_id, prompt='', previous_node_id=None, run_id=None, use_cache=True, by_reference=False,
+                   fused_nodes=None, retry_policy=None):
+    started_at = _node_started(run_id, node_id)
     logger.info(f"Generate image task started with prompt: {prompt}")
     try:
         if not prompt and previous_node_id:
             # Fetch the prompt from the previous node's result
-            previous_result = accumulated_results.get(previous_node_id, {})
+            previous_result = _get_input(accumulated_results, previous_node_id)
+            skipped = _upstream_failure(previous_result, previous_node_id)
+            if skipped:
+                accumulated_results[node_id] = skipped
+                return _node_finished(accumulated_results, node_id, 'generateImage', started_at, run_id, by_reference, fused_nodes)
             prompt = previous_result.get('text', '')
             if not prompt:
                 raise ValueError("No prompt found in previous node results.")
             logger.info(f"Using prompt from node {previous_node_id}: {prompt}")
-        response = client.images.generate(
-            model="dall-e-3",
-            prompt=prompt,
-            n=1,
-            size="1024x1024"
-        )
-        image_url = response.data[0].url
-        accumulated_results[node_id] = {'image_url': image_url}
+        def request_image():
+            response = get_openai_client().images.generate(
+                model="dall-e-3",
+                prompt=prompt,
+                n=1,
+                size="1024x1024"
+            )
+            # The URL is cached with the time it stops working, however long it stays cached
+            return {'url': response.data[0].url, 'expires_at': time.time() + IMAGE_URL_LIFETIME}
+
+        def create_image():
+            return rate_limited_call('dall-e-3', request_image)
+
+        image, cache_status = cached_call('generate_image', 'dall-e-3', prompt, {'n': 1, 'size': '1024x1024'},
+                                          create_image, use_cache, ttl=IMAGE_CACHE_TTL)
+        if not isinstance(image, dict):
+            # Cached before expiry times were recorded: it has at least this long left
+            image = {'url': image, 'expires_at': time.time() + IMAGE_URL_LIFETIME - IMAGE_CACHE_TTL}
+        image_url = image['url']
+        accumulated_results[node_id] = {'image_url': image_url, 'expires_at': image['expires_at'], 'cache': cache_status}
         logger.info(f"Generate image task completed for node {node_id} with image URL: {image_url}")
-        return accumulated_results
+        return _node_finished(accumulated_results, node_id, 'generateImage', started_at, run_id, by_reference, fused_nodes)
     except Exception as e:
+        _retry_if_transient(self, e, node_id, run_id, retry_policy)
         logger.error(f"Error in generate_image for node {node_id}: {str(e)}")
         accumulated_results[node_id] = {'error': str(e)}
-        return accumulated_results
+        return _node_finished(accumulated_results, node_id, 'generateImage', started_at, run_id, by_reference, fused_nodes)
 
 @celery_app.task(name='tasks.display_image')
-def display_image(accumulated_results, node_id, previous_node_id):
+def display_image(accumulated_results, node_id, previous_node_id, run_id=None, by_reference=False):
+    started_at = _node_started(run_id, node_id)
     logger.info(f"Display image task started")
     try:
-        previous_result = accumulated_results.get(previous_node_id, {})
-        if 'error' in previous_result:
-            accumulated_results[node_id] = previous_result
-        else:
-            image_url = previous_result.get('image_url', '')
-            accumulated_results[node_id] = {'image_url': image_url}
+        previous_result = _get_input(accumulated_results, previous_node_id)
+        accumulated_results[node_id] = _upstream_failure(previous_result, previous_node_id) or _display_image_output(previous_result)
         logger.info(f"Display image task completed with result: {accumulated_results[node_id]}")
-        return accumulated_results
+        return _node_finished(accumulated_results, node_id, 'displayImage', started_at, run_id, by_reference)
     except Exception as e:
         logger.error(f"Error in display_image: {str(e)}")
         accumulated_results[node_id] = {'error': str(e)}
-        return accumulated_results
+        return _node_finished(accumulated_results, node_id, 'displayImage', started_at, run_id, by_reference)
 
-@celery_app.task(name='tasks.text_to_speech')
-def text_to_speech(accumulated_results, node_id, previous_node_id):
+@celery_app.task(name='tasks.text_to_speech', bind=True)
+def text_to_speech(self, accumulated_results, node_id, previous_node_id, run_id=None, use_cache=True, by_reference=False,
+                   fused_nodes=None, retry_policy=None):
+    started_at = _node_started(run_id, node_id)
     logger.info(f"Text-to-speech task started")
     try:
-        previous_result = accumulated_results.get(previous_node_id, {})
+        previous_result = _get_input(accumulated_results, previous_node_id)
+        skipped = _upstream_failure(previous_result, previous_node_id)
+        if skipped:
+            accumulated_results[node_id] = skipped
+            return _node_finished(accumulated_results, node_id, 'textToSpeech', started_at, run_id, by_reference, fused_nodes)
         text = previous_result.get('text', '')
         if not text:
             raise ValueError("No text found in previous node results.")
 
-        # Save the audio file to a BytesIO stream
-        audio_stream = BytesIO()
-
-        with client.audio.speech.with_streaming_response.create(
-                model="tts-1",
-                voice="echo",
-                input=text,
-                response_format="mp3"  # You can also use "pcm" if needed
-        ) as response:
-            for chunk in response.iter_bytes(1024):
-                audio_stream.write(chunk)
+        def synthesize_speech():
+            def request_speech():
+                with get_openai_client().audio.speech.with_streaming_response.create(
+                        model="tts-1",
+                        voice="echo",
+                        input=text,
+                        response_format="mp3"  # You can also use "pcm" if needed
+                ) as response:
+                    # Pipe the audio into Azure Blob Storage as it is synthesized
+                    return stream_audio_to_blob(response.iter_bytes(TTS_CHUNK_SIZE))
 
-        audio_stream.seek(0)
+            return rate_limited_call('tts-1', request_speech)
 
-        # Upload to Azure Blob Storage
-        filename = upload_audio_to_blob(audio_stream)
+        # The blob name is cached rather than the SAS URL, which expires
+        filename, cache_status = cached_call('text_to_speech', 'tts-1', text, {'voice': 'echo', 'response_format': 'mp3'},
+                                             synthesize_speech, use_cache)
 
         #Generate the URL to access the audio file
-        audio_url = generate_blob_sas_url(filename)
+        audio_url, expires_at = generate_blob_sas_url(filename)
 
-        accumulated_results[node_id] = {'audio_url': audio_url}
+        accumulated_results[node_id] = {'audio_url': audio_url, 'expires_at': expires_at, 'cache': cache_status}
         logger.info("Text-to-speech task completed")
-        return accumulated_results
+        return _node_finished(accumulated_results, node_id, 'textToSpeech', started_at, run_id, by_reference, fused_nodes)
     except Exception as e:
+        _retry_if_transient(self, e, node_id, run_id, retry_policy)
         logger.error(f"Error in text_to_speech: {str(e)}")
         accumulated_results[node_id] = {'error': str(e)}
-        return accumulated_results
+        return _node_finished(accumulated_results, node_id, 'textToSpeech', started_at, run_id, by_reference, fused_nodes)
 
 @celery_app.task(name='tasks.start_workflow')
-def start_workflow():
-    # Initialize the accumulated results dictionary
-    return {}
+def start_workflow(seed_results=None):
+    # Initialize the accumulated results dictionary, seeded with any reused node outputs
+    return dict(seed_results or {})
+
+@celery_app.task(name='tasks.merge_results')
+def merge_results(results_list):
+    # Join the accumulated results returned by the tasks of a parallel level
+    accumulated_results = {}
+    for results in results_list:
+        accumulated_results.update(results)
+    return accumulated_results
+
+@celery_app.task(name='tasks.finish_workflow')
+def finish_workflow(accumulated_results, run_id=None, workflow_id=None, fingerprints=None, tenant=None):
+    # The final result holds every output exactly once, whichever way results were passed
+    accumulated_results = resolve_results(accumulated_results)
+    # Store the outputs of a saved workflow so the next run can skip unchanged nodes
+    if workflow_id is not None and fingerprints:
+        save_snapshots(workflow_id, fingerprints, accumulated_results)
+    # Move the node records buffered during the run into the run history tables
+    flush_run(run_id, workflow_id, accumulated_results, fingerprints)
+    # Let the tenant's next run in
+    release(tenant, run_id)
+    # Announce the final results so WebSocket viewers don't have to poll for them
+    publish_progress(run_id, {'state': 'SUCCESS', 'result': accumulated_results})
+    return accumulated_results
@@ -1,24 +1,215 @@
 from fastapi import WebSocket
-from typing import Dict, List
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Set
+import asyncio
 import json
+import logging
+import os
+from progress import PROGRESS_CHANNEL_PREFIX, TERMINAL_STATES
+from redis_client import get_async_redis
+from metrics import span
+
+# Events a viewer may fall behind by before it is dropped; it reconnects and
+# starts again from the run's current status
+WEBSOCKET_SEND_QUEUE_SIZE = int(os.getenv('WEBSOCKET_SEND_QUEUE_SIZE', '100'))
+# A viewer whose socket takes longer than this to accept one event is dropped
+WEBSOCKET_SEND_TIMEOUT = float(os.getenv('WEBSOCKET_SEND_TIMEOUT', '5'))
+# Close code telling a dropped viewer to reconnect later (1013, Try Again Later)
+SLOW_VIEWER_CLOSE_CODE = 1013
+
+logger = logging.getLogger(__name__)
+
+class Viewer:
+    """
+    One WebSocket watching a run. Events are queued for it without waiting and its own
+    sender task writes them to the socket, so a slow socket only delays itself.
+    """
+    def __init__(self, websocket: WebSocket, workflow_id: str, on_error: Callable[['Viewer', Exception], None]):
+        self.websocket = websocket
+        self.workflow_id = workflow_id
+        self.pending: Deque[dict] = deque()
+        self.closed = False
+        # Set once the run has finished or the viewer was dropped
+        self.done = asyncio.Event()
+        self._wakeup = asyncio.Event()
+        self._flushed = asyncio.Event()
+        self._flushed.set()
+        self._sender = asyncio.create_task(self._send_pending(on_error))
+
+    def send(self, data: dict) -> bool:
+        """
+        Queues an event for the socket. Returns False if the viewer has fallen too far
+        behind and should be dropped.
+        """
+        if self.closed:
+            return False
+        # Streamed deltas of a node merge into one message while the socket catches up
+        if data.get('status') == 'STREAMING' and self.pending:
+            last = self.pending[-1]
+            if last.get('status') == 'STREAMING' and last.get('node_id') == data.get('node_id'):
+                self.pending[-1] = dict(last, delta=last['delta'] + data['delta'])
+                return True
+        if len(self.pending) >= WEBSOCKET_SEND_QUEUE_SIZE:
+            return False
+        self.pending.append(data)
+        self._flushed.clear()
+        self._wakeup.set()
+        return True
+
+    async def _send_pending(self, on_error):
+        try:
+            while True:
+                if not self.pending:
+                    self._flushed.set()
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                data = self.pending.popleft()
+                with span('websocket_send_seconds'):
+                    await asyncio.wait_for(self.websocket.send_json(data), WEBSOCKET_SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            on_error(self, e)
+
+    async def flush(self):
+        """
+        Waits (up to WEBSOCKET_SEND_TIMEOUT) until the queued events are sent, then
+        stops the sender.
+        """
+        if not self.closed and not self._sender.done():
+            try:
+                await asyncio.wait_for(self._flushed.wait(), WEBSOCKET_SEND_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+        self.stop()
+
+    def stop(self):
+        if self._sender is not asyncio.current_task():
+            self._sender.cancel()
 
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {}
+        self.active_connections: Dict[str, Set[Viewer]] = {}
+        self.run_waiters: Dict[str, List[asyncio.Future]] = {}
+        self._listener: Optional[asyncio.Task] = None
+        self._closing: Set[asyncio.Task] = set()
 
-    async def connect(self, websocket: WebSocket, workflow_id: str):
+    async def connect(self, websocket: WebSocket, workflow_id: str) -> Viewer:
         await websocket.accept()
-        if workflow_id not in self.active_connections:
-            self.active_connections[workflow_id] = []
-        self.active_connections[workflow_id].append(websocket)
+        viewer = Viewer(websocket, workflow_id, self._drop)
+        self.active_connections.setdefault(workflow_id, set()).add(viewer)
+        return viewer
+
+    async def disconnect(self, viewer: Viewer):
+        """
+        Removes a viewer once the events already queued for it are sent.
+        """
+        self._remove(viewer)
+        await viewer.flush()
+
+    def _remove(self, viewer: Viewer):
+        viewers = self.active_connections.get(viewer.workflow_id)
+        if viewers is not None:
+            viewers.discard(viewer)
+            if not viewers:
+                del self.active_connections[viewer.workflow_id]
 
-    async def disconnect(self, websocket: WebSocket, workflow_id: str):
-        if workflow_id in self.active_connections:
-            self.active_connections[workflow_id].remove(websocket)
+    def _drop(self, viewer: Viewer, reason):
+        if viewer.closed:
+            return
+        logger.info(f"Dropping WebSocket for workflow {viewer.workflow_id}: {reason}")
+        viewer.closed = True
+        viewer.pending.clear()
+        viewer.done.set()
+        self._remove(viewer)
+        viewer.stop()
+        closing = asyncio.ensure_future(self._close(viewer.websocket))
+        self._closing.add(closing)
+        closing.add_done_callback(self._closing.discard)
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            await asyncio.wait_for(websocket.close(code=SLOW_VIEWER_CLOSE_CODE), WEBSOCKET_SEND_TIMEOUT)
+        except Exception:
+            pass
 
     async def send_update(self, workflow_id: str, data: dict):
-        if workflow_id in self.active_connections:
-            for connection in self.active_connections[workflow_id]:
-                await connection.send_json(data)
+        """
+        Queues an event for every viewer of the workflow without waiting on any socket.
+        Viewers too far behind to take it are dropped.
+        """
+        for viewer in list(self.active_connections.get(workflow_id, ())):
+            if not viewer.send(data):
+                self._drop(viewer, f"more than {WEBSOCKET_SEND_QUEUE_SIZE} events behind")
+
+    async def wait_for_completion(self, viewer: Viewer, timeout: float) -> bool:
+        """
+        Waits until the terminal event of the viewer's run has been queued for it, or
+        the viewer was dropped. Returns False if the timeout expires first.
+        """
+        try:
+            await asyncio.wait_for(viewer.done.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def watch_run(self, run_id: str) -> asyncio.Future:
+        """
+        Returns a future resolved with the terminal event of a run. Register it
+        before starting the run so a fast run cannot finish unobserved.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.run_waiters.setdefault(run_id, []).append(future)
+        return future
+
+    def unwatch_run(self, run_id: str, future: asyncio.Future):
+        waiters = self.run_waiters.get(run_id, [])
+        if future in waiters:
+            waiters.remove(future)
+        if not waiters:
+            self.run_waiters.pop(run_id, None)
+
+    async def start_listener(self):
+        """
+        Starts the single Redis subscriber that relays progress events of every run
+        to the sockets watching it, however many sockets are open. Every API replica
+        runs one, so viewers see a run's events whichever replica they are connected to.
+        """
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop_listener(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+
+    async def _listen(self):
+        while True:
+            try:
+                pubsub = get_async_redis().pubsub()
+                await pubsub.psubscribe(f"{PROGRESS_CHANNEL_PREFIX}*")
+                async for message in pubsub.listen():
+                    if message['type'] != 'pmessage':
+                        continue
+                    workflow_id = message['channel'].decode()[len(PROGRESS_CHANNEL_PREFIX):]
+                    # Events of runs nobody is watching from this process are dropped
+                    if workflow_id not in self.active_connections and workflow_id not in self.run_waiters:
+                        continue
+                    await self.dispatch(workflow_id, json.loads(message['data']))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Progress listener failed, resubscribing: {str(e)}")
+                await asyncio.sleep(1)
+
+    async def dispatch(self, workflow_id: str, data: dict):
+        await self.send_update(workflow_id, data)
+        if data.get('state') in TERMINAL_STATES:
+            for viewer in self.active_connections.get(workflow_id, ()):
+                viewer.done.set()
+            for future in self.run_waiters.pop(workflow_id, []):
+                if not future.done():
+                    future.set_result(data)
 
 manager = ConnectionManager()
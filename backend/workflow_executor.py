@@ -1,18 +1,49 @@
-from celery import chain
-from typing import Dict, Any
-from tasks import generate_text, display_text, generate_image, display_image, text_to_speech, start_workflow
-from celery_app import celery_app  
-from collections import defaultdict, deque
+from celery import group
+from typing import Dict, Any, List, Optional
+from celery_app import celery_app, RUN_PRIORITIES
+from collections import defaultdict, deque, OrderedDict
+import hashlib
+import json
 import logging
+import os
+import threading
+import time
+import uuid
+from node_snapshots import compute_fingerprint, load_snapshots, is_reusable
+from batch_status import is_batch_id, get_batch_status
+from redis_client import get_redis
+from metrics import observe, span
+from fair_share import release, track_run, try_acquire
+from node_retry import validate_policy
 
+# Tasks are referenced by name so the API can build runs without importing tasks.py
+# and the provider SDKs behind it
 TASK_MAPPING = {
-    'generateText': generate_text,
-    'displayText': display_text,
-    'generateImage': generate_image,
-    'displayImage': display_image,
-    'textToSpeech': text_to_speech
+    'generateText': 'tasks.generate_text',
+    'displayText': 'tasks.display_text',
+    'generateImage': 'tasks.generate_image',
+    'displayImage': 'tasks.display_image',
+    'textToSpeech': 'tasks.text_to_speech'
 }
 
+# Block types computed by tasks.LIGHT_NODE_OUTPUTS without a task of their own
+LIGHT_NODE_TYPES = ('displayText', 'displayImage')
+
+# Run lightweight nodes inside the task that produces their input instead of as tasks of their own
+FUSE_LIGHT_NODES = os.getenv('FUSE_LIGHT_NODES', 'true').lower() == 'true'
+
+PLAN_KEY_PREFIX = 'workflow-plan:'
+# Part of every plan's cache key: bump it whenever a change to the code alters what a
+# compiled plan holds (signature kwargs, fusion, levels), so plans cached by older
+# code are never used
+PLAN_SCHEMA_VERSION = 3
+PLAN_TTL = int(os.getenv('WORKFLOW_PLAN_TTL', str(7 * 24 * 3600)))
+PLAN_CACHE_SIZE = int(os.getenv('WORKFLOW_PLAN_CACHE_SIZE', '256'))
+
+# In-process LRU of compiled plans keyed by plan_cache_key
+_plan_cache: 'OrderedDict[str, WorkflowPlan]' = OrderedDict()
+_plan_cache_lock = threading.Lock()
+
 logger = logging.getLogger(__name__)
 
 def build_dependency_graph(blocks: list, edges: list) -> Dict[str, list]:
@@ -59,128 +90,466 @@ def topological_sort(blocks: list, edges: list) -> list:
     
     return sorted_order
 
-def get_block_by_id(blocks: list, node_id: str) -> Dict[str, Any]:
+def get_execution_levels(blocks: list, edges: list) -> List[List[str]]:
     """
-    Retrieves a block dictionary by its node_id.
+    Groups node_ids into levels so that every node only depends on nodes from earlier levels.
+    Nodes within a level are independent of each other and can run concurrently.
     """
+    graph, in_degree = build_dependency_graph(blocks, edges)
+    level = [node for node in in_degree if in_degree[node] == 0]
+    levels = []
+    visited = 0
+
+    while level:
+        levels.append(level)
+        visited += len(level)
+        next_level = []
+        for node in level:
+            for neighbor in graph[node]:
+                in_degree[neighbor] -= 1
+                if in_degree[neighbor] == 0:
+                    next_level.append(neighbor)
+        level = next_level
+
+    if visited != len(blocks):
+        raise ValueError("Cycle detected in workflow dependencies.")
+
+    return levels
+
+def build_edges(blocks: list) -> list:
+    """
+    Builds the edge list of a workflow from the 'inputs' mapping of each block.
+    """
+    edges = []
     for block in blocks:
-        if block['id'] == node_id:
-            return block
-    raise ValueError(f"Block with id {node_id} not found.")
+        node_id = block['id']
+        inputs = block.get('inputs', {})
+        for input_key, source_node_id in inputs.items():
+            edges.append({
+                'source': source_node_id,
+                'target': node_id
+            })
+    return edges
 
-def execute_workflow(workflow: Dict[str, Any]):
-    try:
-        blocks = workflow.get('blocks', [])
-        edges = []
-
-        for block in blocks:
-            node_id = block['id']
-            inputs = block.get('inputs', {})
-            for input_key, source_node_id in inputs.items():
-                edges.append({
-                    'source': source_node_id,
-                    'target': node_id
-                })
-        
-        logger.info(f"Starting workflow execution with {len(blocks)} blocks")
+def task_signature(task_name: str, **kwargs):
+    return celery_app.signature(task_name, kwargs=kwargs)
+
+def build_task_signature(block: Dict[str, Any], run_id: Optional[str] = None, use_cache: bool = True,
+                         by_reference: bool = False, stream: bool = False):
+    """
+    Validates a block and prepares the Celery signature that executes it.
+    use_cache=False makes the provider-backed tasks skip the result cache,
+    by_reference=True makes the task store its output in the run's result store
+    and pass on only a reference to it, and stream=True makes generate_text
+    forward its tokens to the run's viewers as they are generated.
+    """
+    node_id = block['id']
+    task_type = block['type']
+    data = block.get('data', {})
+    task_name = TASK_MAPPING.get(task_type)
+    if not task_name:
+        raise ValueError(f"Unknown task type: {task_type}")
+
+    run_options = {'run_id': run_id, 'by_reference': by_reference}
+
+    # Prepare the task signature
+    if task_type == 'generateText':
+        prompt = data.get('prompt', '')
+        task_sig = task_signature(task_name, node_id=node_id, prompt=prompt, use_cache=use_cache, stream=stream, **run_options)
+        logger.info(f"Prepared generate_text task for node {node_id} with prompt: {prompt}")
+    elif task_type == 'displayText':
+        previous_node_id = block['inputs'].get('input')
+        if previous_node_id is None:
+            raise ValueError("displayText task requires a previous node")
+        task_sig = task_signature(task_name, node_id=node_id, previous_node_id=previous_node_id, **run_options)
+        logger.info(f"Prepared display_text task for node {node_id} dependent on {previous_node_id}")
+    elif task_type == 'generateImage':
+        prompt = data.get('prompt', '')
+        if not prompt:
+            previous_node_id = block['inputs'].get('input')
+            if not previous_node_id:
+                raise ValueError("generateImage task requires a prompt or a previous node")
+            task_sig = task_signature(task_name, node_id=node_id, prompt=None, previous_node_id=previous_node_id, use_cache=use_cache, **run_options)
+            logger.info(f"Prepared generate_image task for node {node_id} dependent on {previous_node_id}")
+        else:
+            task_sig = task_signature(task_name, node_id=node_id, prompt=prompt, use_cache=use_cache, **run_options)
+            logger.info(f"Prepared generate_image task for node {node_id} with prompt: {prompt}")
+    elif task_type == 'displayImage':
+        previous_node_id = block['inputs'].get('input')
+        if not previous_node_id:
+            raise ValueError("displayImage task requires a previous node")
+        task_sig = task_signature(task_name, node_id=node_id, previous_node_id=previous_node_id, **run_options)
+        logger.info(f"Prepared display_image task for node {node_id} dependent on {previous_node_id}")
+    elif task_type == 'textToSpeech':
+        previous_node_id = block['inputs'].get('input')
+        if not previous_node_id:
+            raise ValueError("textToSpeech task requires a previous node")
+        task_sig = task_signature(task_name, node_id=node_id, previous_node_id=previous_node_id, use_cache=use_cache, **run_options)
+        logger.info(f"Prepared text_to_speech task for node {node_id} dependent on {previous_node_id}")
+    else:
+        raise ValueError(f"Unknown task type: {task_type}")
+
+    # Provider-backed nodes may replace the default retry policy (see node_retry)
+    retry_policy = data.get('retry')
+    if retry_policy is not None and task_type not in LIGHT_NODE_TYPES:
+        task_sig = task_sig.clone(kwargs={'retry_policy': validate_policy(node_id, retry_policy)})
+
+    return task_sig
+
+def fuse_light_nodes(blocks_by_id: Dict[str, Dict[str, Any]], execution_order: List[str], edges: list,
+                     pending: Optional[List[str]] = None):
+    """
+    Attaches every lightweight node (see LIGHT_NODE_TYPES) to the provider task
+    producing its input, directly or through other fused nodes, so it costs no broker
+    round trip of its own. Only nodes in pending (all nodes by default) are considered.
+
+    Returns the node_ids that still need a task of their own in execution order, the
+    fused node specs per host node_id, and the edges between those scheduled nodes.
+    """
+    pending = set(execution_order if pending is None else pending)
+    host_of = {}
+    fused_nodes = defaultdict(list)
+    scheduled = []
+
+    for node_id in execution_order:
+        if node_id not in pending:
+            continue
+        block = blocks_by_id[node_id]
+        source_node_id = block.get('inputs', {}).get('input')
+        host = host_of.get(source_node_id, source_node_id)
+        if (FUSE_LIGHT_NODES and block['type'] in LIGHT_NODE_TYPES and source_node_id in pending
+                and blocks_by_id[host]['type'] not in LIGHT_NODE_TYPES):
+            host_of[node_id] = host
+            fused_nodes[host].append({
+                'node_id': node_id,
+                'type': block['type'],
+                'previous_node_id': source_node_id
+            })
+        else:
+            scheduled.append(node_id)
+
+    scheduled_edges = []
+    seen = set()
+    for edge in edges:
+        if edge['source'] not in pending:
+            continue
+        source = host_of.get(edge['source'], edge['source'])
+        target = host_of.get(edge['target'], edge['target'])
+        if source != target and (source, target) not in seen:
+            seen.add((source, target))
+            scheduled_edges.append({'source': source, 'target': target})
+
+    return scheduled, dict(fused_nodes), scheduled_edges
+
+class WorkflowPlan:
+    """
+    Everything execute_workflow derives from the blocks alone: the node index, the
+    execution order, the nodes that get a task of their own and the lightweight nodes
+    fused into them, the parallelism levels, the validated task signatures and the
+    node fingerprints. A plan is compiled once and can start any number of runs.
+    """
+    def __init__(self, blocks: list, edges: list, execution_order: List[str], scheduled_order: List[str],
+                 fused_nodes: Dict[str, List[Dict[str, str]]], levels: List[List[str]],
+                 signatures: Dict[str, Any], fingerprints: Dict[str, str]):
+        self.blocks = blocks
+        self.blocks_by_id = {block['id']: block for block in blocks}
+        self.edges = edges
+        self.execution_order = execution_order
+        self.scheduled_order = scheduled_order
+        self.fused_nodes = fused_nodes
+        self.levels = levels
+        self.signatures = signatures
+        self.fingerprints = fingerprints
+
+    @classmethod
+    def build(cls, blocks: list) -> 'WorkflowPlan':
+        blocks_by_id = {block['id']: block for block in blocks}
+        edges = build_edges(blocks)
 
         # Perform topological sort to determine execution order
         execution_order = topological_sort(blocks, edges)
-        logger.info(f"Execution order: {execution_order}")
-
-        # Start with the initial task that initializes accumulated_results
-        tasks_chain = start_workflow.s()
+        scheduled_order, fused_nodes, scheduled_edges = fuse_light_nodes(blocks_by_id, execution_order, edges)
+        levels = get_execution_levels([blocks_by_id[node_id] for node_id in scheduled_order], scheduled_edges)
 
         # Map to store task signatures by node_id
-        task_signatures = {}
+        signatures = {node_id: build_task_signature(blocks_by_id[node_id]) for node_id in execution_order}
 
-        # Process blocks in the order they appear
+        fingerprints = {}
         for node_id in execution_order:
-            block = get_block_by_id(blocks, node_id)
-            task_type = block['type']
-            data = block.get('data', {})
-            #inputs = block.get('inputs', {})
-            task_func = TASK_MAPPING.get(task_type)
-            if not task_func:
-                raise ValueError(f"Unknown task type: {task_type}")
-
-            # Prepare the task signature
-            if task_type == 'generateText':
-                prompt = data.get('prompt', '')
-                task_sig = task_func.s(node_id=node_id, prompt=prompt)
-                logger.info(f"Prepared generate_text task for node {node_id} with prompt: {prompt}")
-            elif task_type == 'displayText':
-                previous_node_id = block['inputs'].get('input')
-                if previous_node_id is None:
-                    raise ValueError("displayText task requires a previous node")
-                task_sig = task_func.s(node_id=node_id, previous_node_id=previous_node_id)
-                logger.info(f"Prepared display_text task for node {node_id} dependent on {previous_node_id}")
-            elif task_type == 'generateImage':
-                prompt = data.get('prompt', '')
-                if not prompt:
-                    previous_node_id = block['inputs'].get('input')
-                    if not previous_node_id:
-                        raise ValueError("generateImage task requires a prompt or a previous node")
-                    task_sig = task_func.s(node_id=node_id, prompt=None, previous_node_id=previous_node_id)
-                    logger.info(f"Prepared generate_image task for node {node_id} dependent on {previous_node_id}")
-                else:
-                    task_sig = task_func.s(node_id=node_id, prompt=prompt)
-                    logger.info(f"Prepared generate_image task for node {node_id} with prompt: {prompt}")
-            elif task_type == 'displayImage':
-                previous_node_id = block['inputs'].get('input')
-                if not previous_node_id:
-                    raise ValueError("displayImage task requires a previous node")
-                task_sig = task_func.s(node_id=node_id, previous_node_id=previous_node_id)
-                logger.info(f"Prepared display_image task for node {node_id} dependent on {previous_node_id}")
-            elif task_type == 'textToSpeech':
-                previous_node_id = block['inputs'].get('input')
-                if not previous_node_id:
-                    raise ValueError("textToSpeech task requires a previous node")
-                task_sig = task_func.s(node_id=node_id, previous_node_id=previous_node_id)
-                logger.info(f"Prepared text_to_speech task for node {node_id} dependent on {previous_node_id}")
-            else:
-                raise ValueError(f"Unknown task type: {task_type}")
-            
-            task_signatures[node_id] = task_sig
+            upstream = blocks_by_id[node_id].get('inputs', {}).values()
+            fingerprints[node_id] = compute_fingerprint(
+                signatures[node_id],
+                {source_node_id: fingerprints[source_node_id] for source_node_id in upstream}
+            )
 
-        for node_id in execution_order:
-            tasks_chain = tasks_chain | task_signatures[node_id]
+        return cls(blocks, edges, execution_order, scheduled_order, fused_nodes, levels, signatures, fingerprints)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'blocks': self.blocks,
+            'edges': self.edges,
+            'execution_order': self.execution_order,
+            'scheduled_order': self.scheduled_order,
+            'fused_nodes': self.fused_nodes,
+            'levels': self.levels,
+            'signatures': {node_id: dict(sig) for node_id, sig in self.signatures.items()},
+            'fingerprints': self.fingerprints
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'WorkflowPlan':
+        signatures = {node_id: celery_app.signature(sig) for node_id, sig in data['signatures'].items()}
+        return cls(data['blocks'], data['edges'], data['execution_order'], data['scheduled_order'],
+                   data['fused_nodes'], data['levels'], signatures, data['fingerprints'])
 
-        # Execute the chain of tasks asynchronously
-        result = tasks_chain.apply_async()
-        logger.info(f"Workflow started with task_id: {result.id}")
-        return result  # This is a Celery AsyncResult with an ID
+    def signature_for_run(self, node_id: str, run_id: str, use_cache: bool = True, by_reference: bool = False,
+                          stream: bool = False, data_override: Optional[Dict[str, Any]] = None):
+        """
+        Returns the node's signature bound to one run. A data override (e.g. a different
+        prompt for one item of a batch) re-validates just that block.
+        """
+        if data_override:
+            block = dict(self.blocks_by_id[node_id])
+            block['data'] = dict(block.get('data', {}), **data_override)
+            return build_task_signature(block, run_id, use_cache, by_reference, stream)
 
+        run_kwargs = {'run_id': run_id, 'by_reference': by_reference}
+        if 'use_cache' in self.signatures[node_id].kwargs:
+            run_kwargs['use_cache'] = use_cache
+        if 'stream' in self.signatures[node_id].kwargs:
+            run_kwargs['stream'] = stream
+        return self.signatures[node_id].clone(kwargs=run_kwargs)
+
+def plan_cache_key(blocks: list) -> str:
+    """
+    Hashes the canonical form of the blocks, so identical graphs share one compiled plan,
+    together with the plan schema version and the settings that change how blocks compile.
+    """
+    canonical = json.dumps({
+        'version': PLAN_SCHEMA_VERSION,
+        'fuse_light_nodes': FUSE_LIGHT_NODES,
+        'blocks': [
+            {
+                'id': block['id'],
+                'type': block.get('type'),
+                'inputs': block.get('inputs', {}),
+                'data': block.get('data', {})
+            }
+            for block in blocks
+        ]
+    }, sort_keys=True)
+    return PLAN_KEY_PREFIX + hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def compile_workflow(blocks: list) -> WorkflowPlan:
+    """
+    Validates a workflow and compiles it into a reusable plan. Plans are cached in
+    process and in Redis by the hash of the blocks, so repeated and batch runs of the
+    same graph skip planning entirely.
+    """
+    key = plan_cache_key(blocks)
+    with _plan_cache_lock:
+        plan = _plan_cache.get(key)
+        if plan is not None:
+            _plan_cache.move_to_end(key)
+            return plan
+
+    plan = None
+    try:
+        raw = get_redis().get(key)
+        if raw is not None:
+            plan = WorkflowPlan.from_dict(json.loads(raw))
+            logger.info(f"Loaded compiled workflow plan {key} from Redis")
+    except Exception as e:
+        logger.warning(f"Could not load workflow plan from Redis: {str(e)}")
+
+    if plan is None:
+        plan = WorkflowPlan.build(blocks)
+        logger.info(f"Compiled workflow with {len(blocks)} blocks, execution order: {plan.execution_order}")
+        try:
+            get_redis().set(key, json.dumps(plan.to_dict()), ex=PLAN_TTL)
+        except Exception as e:
+            logger.warning(f"Could not store workflow plan in Redis: {str(e)}")
+
+    with _plan_cache_lock:
+        _plan_cache[key] = plan
+        while len(_plan_cache) > PLAN_CACHE_SIZE:
+            _plan_cache.popitem(last=False)
+    return plan
+
+def invalidate_workflow_plan(blocks: list):
+    """
+    Drops the compiled plan of a workflow definition, e.g. when a saved workflow is updated.
+    """
+    key = plan_cache_key(blocks)
+    with _plan_cache_lock:
+        _plan_cache.pop(key, None)
+    try:
+        get_redis().delete(key)
+    except Exception as e:
+        logger.warning(f"Could not drop workflow plan from Redis: {str(e)}")
+
+def execute_workflow(workflow: Dict[str, Any], workflow_id: Optional[int] = None):
+    """
+    Compiles a workflow and starts a run of it. See run_plan for the run options.
+    """
+    try:
+        blocks = workflow.get('blocks', [])
+        logger.info(f"Starting workflow execution with {len(blocks)} blocks")
+        with span('workflow_plan_seconds', stage='compile'):
+            plan = compile_workflow(blocks)
+        return run_plan(plan, workflow, workflow_id)
     except Exception as e:
         logger.error(f"Workflow execution failed: {str(e)}")
         raise
 
+def run_plan(plan: WorkflowPlan, options: Dict[str, Any], workflow_id: Optional[int] = None,
+             overrides: Optional[Dict[str, Dict[str, Any]]] = None, run_id: Optional[str] = None,
+             resume_outputs: Optional[Dict[str, Any]] = None):
+    """
+    Builds the Celery canvas for one run of a compiled workflow and starts it.
+
+    In parallel mode (the default) the blocks are grouped into dependency levels and
+    every level with more than one node runs as a group whose results are merged
+    before the next level starts, so independent branches execute concurrently.
+    With 'parallel' set to False every node runs one after another in a single chain.
+
+    The run id doubles as the id of the returned AsyncResult and names the pub/sub
+    channel the tasks report their progress on. 'use_cache' set to False bypasses
+    the provider result cache for this run, and 'by_reference' set to True makes
+    every node write its output once to the run's result store and pass on only a
+    reference, instead of shipping all outputs through every hop of the chain.
+    'stream' set to True makes text nodes publish their tokens as they arrive.
+
+    A run with a 'tenant' counts against it (see fair_share) until it finishes. Runs
+    with 'bulk' set, and runs of a tenant already at its share, are dispatched at
+    bulk priority so they only use workers that interactive runs leave idle. Callers
+    that already hold the run's slot (batches wait for one) pass 'slot_held'.
+
+    For a saved workflow (workflow_id given) the outputs of the nodes that ran are
+    stored with their fingerprints. Unless 'incremental' is False, nodes whose
+    fingerprint matches a stored output are not scheduled again: their outputs seed
+    accumulated_results and only the changed nodes and everything downstream of
+    them run. overrides maps node_ids to data that replaces the block's data for
+    this run only. A run_id can be passed in by callers that need to subscribe to
+    the run's progress before it starts.
+
+    resume_outputs maps node_ids to outputs of an earlier run to start from instead
+    of the stored ones (see the resume endpoint): only the other nodes are scheduled.
+    """
+    scheduling_started = time.perf_counter()
+    run_id = run_id or str(uuid.uuid4())
+    parallel = options.get('parallel', True)
+    use_cache = options.get('use_cache', True)
+    incremental = options.get('incremental', True)
+    by_reference = options.get('by_reference', False)
+    stream = options.get('stream', False)
+    tenant = options.get('tenant')
+    overrides = overrides or {}
+
+    priority = RUN_PRIORITIES['bulk' if options.get('bulk') else 'interactive']
+    if tenant and not options.get('slot_held') and not try_acquire(tenant, run_id):
+        logger.info(f"Tenant {tenant} is over its share, dispatching run {run_id} at bulk priority")
+        priority = RUN_PRIORITIES['bulk']
+
+    reusable = {}
+    if resume_outputs is not None:
+        reusable = resume_outputs
+    elif workflow_id is not None and incremental and not overrides:
+        snapshots = load_snapshots(workflow_id)
+        reusable = {node_id: snapshots[node_id]['output'] for node_id in plan.execution_order
+                    if is_reusable(snapshots.get(node_id), plan.fingerprints[node_id])}
+
+    seed_results = {}
+    for node_id in plan.execution_order:
+        upstream = plan.blocks_by_id[node_id].get('inputs', {}).values()
+        # A node is only reused if everything feeding it is reused as well
+        if node_id in reusable and all(source_node_id in seed_results for source_node_id in upstream):
+            seed_results[node_id] = reusable[node_id]
+    if reusable:
+        logger.info(f"Reusing stored outputs for {len(seed_results)} of {len(plan.blocks)} blocks")
+
+    pending = [node_id for node_id in plan.execution_order if node_id not in seed_results]
+    scheduled, fused_nodes, levels = plan.scheduled_order, plan.fused_nodes, plan.levels
+    if seed_results:
+        scheduled, fused_nodes, scheduled_edges = fuse_light_nodes(plan.blocks_by_id, plan.execution_order, plan.edges, pending)
+        levels = get_execution_levels([plan.blocks_by_id[node_id] for node_id in scheduled], scheduled_edges)
+
+    task_signatures = {}
+    for node_id in scheduled:
+        task_sig = plan.signature_for_run(node_id, run_id, use_cache, by_reference, stream, overrides.get(node_id))
+        if node_id in fused_nodes:
+            task_sig = task_sig.clone(kwargs={'fused_nodes': fused_nodes[node_id]})
+        task_signatures[node_id] = task_sig.set(priority=priority)
+
+    # Start with the initial task that initializes accumulated_results
+    tasks_chain = task_signature('tasks.start_workflow', seed_results=seed_results).set(priority=priority)
+
+    if parallel:
+        logger.info(f"Execution levels: {levels}")
+
+        for level in levels:
+            signatures = [task_signatures[node_id] for node_id in level]
+            if len(signatures) == 1:
+                tasks_chain = tasks_chain | signatures[0]
+            else:
+                # A group followed by merge_results becomes a chord: the level
+                # fans out across workers and joins back into one results dict
+                tasks_chain = tasks_chain | group(signatures) | task_signature('tasks.merge_results').set(priority=priority)
+    else:
+        for node_id in scheduled:
+            tasks_chain = tasks_chain | task_signatures[node_id]
+
+    # Overridden runs are not the saved workflow, so they don't update its stored outputs
+    # or record fingerprints a later resume could match
+    fingerprints = {}
+    if workflow_id is not None and not overrides:
+        fingerprints = plan.fingerprints
+    tasks_chain = tasks_chain | task_signature('tasks.finish_workflow', run_id=run_id, workflow_id=workflow_id,
+                                               fingerprints=fingerprints, tenant=tenant).set(priority=priority)
+
+    observe('workflow_plan_seconds', time.perf_counter() - scheduling_started, stage='schedule')
+
+    # Execute the chain of tasks asynchronously; the last task of a chain takes the given task_id
+    track_run(run_id)
+    try:
+        with span('workflow_plan_seconds', stage='dispatch'):
+            result = tasks_chain.apply_async(task_id=run_id)
+    except Exception:
+        release(tenant, run_id)
+        raise
+    logger.info(f"Workflow started with task_id: {result.id}")
+    return result  # This is a Celery AsyncResult with an ID
+
 def get_task_status(task_id: str) -> Dict[str, Any]:
-    """Get the status of a task by its ID."""
+    """Get the status of a task by its ID. Batch ids return the aggregate progress of the batch."""
     try:
-        result = celery_app.AsyncResult(task_id)
-        logger.info(f"Checking task {task_id} status: {result.state}")
+        if is_batch_id(task_id):
+            return get_batch_status(task_id)
 
-        if result.ready():
-            if result.successful():
-                task_result = result.get()
-                logger.info(f"Task completed successfully: {task_result}")
-                return {
-                    'state': 'SUCCESS',
-                    'result': task_result
-                }
+        with span('workflow_status_lookup_seconds'):
+            result = celery_app.AsyncResult(task_id)
+            logger.info(f"Checking task {task_id} status: {result.state}")
+
+            if result.ready():
+                if result.successful():
+                    task_result = result.get()
+                    logger.info(f"Task completed successfully: {task_result}")
+                    return {
+                        'state': 'SUCCESS',
+                        'result': task_result
+                    }
+                else:
+                    error = str(result.result)
+                    logger.error(f"Task failed with error: {error}")
+                    return {
+                        'state': 'FAILURE',
+                        'error': error
+                    }
             else:
-                error = str(result.result)
-                logger.error(f"Task failed with error: {error}")
+                logger.info(f"Task {task_id} is {result.state}")
                 return {
-                    'state': 'FAILURE',
-                    'error': error
+                    'state': result.state
                 }
-        else:
-            logger.info(f"Task {task_id} is {result.state}")
-            return {
-                'state': result.state
-            }
     except Exception as e:
         logger.error(f"Error getting task status: {str(e)}")
         return {